@@ -97,10 +97,11 @@ class Evaluator:
 
         users = self._get_survey_users()
 
-        for user in users:
-            my_position = dict(latitude=45.86432820440195, longitude=9.488129491092195)
-            r = rs.Recommender(50, 3500, 4000, my_position, user.id)
-            final_paths = r.recommend(method, baseline)
+        # Paths are the same for all users: they are found once, and ranked for all the users together
+        my_position = dict(latitude=45.86432820440195, longitude=9.488129491092195)
+        r = rs.Recommender(50, 3500, 4000, my_position, None)
+        users_paths = r.recommend_users(users, method, baseline)
+        for user, final_paths in zip(users, users_paths):
             user_row = self.df[self.df.user == user.id]
 
             my_ranking_list = []
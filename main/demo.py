@@ -19,6 +19,7 @@ from sqlalchemy.orm import sessionmaker
 
 import mapgenerator.generator as mapgen
 import recommendation.recommender as rs
+from recommendation.engine import SegmentGraph
 from model import model
 from mapgenerator.graph import MapGraph
 
@@ -28,9 +29,9 @@ class Demo:
     def __init__(self):
         pass
 
-    def recommend_user(self, user_id, method):
+    def recommend_user(self, user_id, method, segment_graph=None):
         my_position = dict(latitude=45.85821905286897, longitude=9.46938252645873)
-        r = rs.Recommender(50, 1950, 2000, my_position, user_id)
+        r = rs.Recommender(50, 1950, 2000, my_position, user_id, segment_graph)
         return r.recommend(method)
 
     def analyze_paths(self, paths):
@@ -44,15 +45,16 @@ class Demo:
                 new_file.write('SegName: {} ->'.format(segment.name))
                 new_file.write('SegLen: {} ->'.format(segment.length))
                 segment_labels = ''
-                for label in segment.labels:
-                    segment_labels += '{} '.format(label.label)
+                for label, label_rate in zip(model.LABELS, segment.get_properties_vector()):
+                    if label_rate:
+                        segment_labels += '{} '.format(label)
                 new_file.write('SegmentLabels: {}\n'.format(segment_labels))
             new_file.write('------------------------------------------\n\n')
         new_file.close()
 
-    def questionnaire_paths(self, user_id, gis_store=False):
+    def questionnaire_paths(self, user_id, gis_store=False, segment_graph=None):
         my_position = dict(latitude=45.86432820440195, longitude=9.488129491092195)
-        r = rs.Recommender(50, 3500, 4000, my_position, user_id)
+        r = rs.Recommender(50, 3500, 4000, my_position, user_id, segment_graph)
         final_paths = r.get_candidate_paths()
 
         # Store paths to GIS
@@ -78,17 +80,21 @@ class Demo:
 
     def start(self):
         mg = mapgen.MapGenerator()
-        mg.generate_segments_txts()
-        mg.generate_map_files('../docs/hiking_resegone_txt/original/', '../docs/map_resegone/original/', eps=30.0)
-        mg.generate_map_files('../docs/hiking_resegone_txt/filtered/', '../docs/map_resegone/filtered/', eps=30.0)
-        mg.generate_map_files('../docs/hiking_resegone_txt/splitted/', '../docs/map_resegone/splitted/', eps=50.0)
+        mg.generate_segments_txts(cache_dir='../docs/hiking_resegone_cache/')
+        mg.run_map_jobs([
+            mapgen.MapJob('../docs/hiking_resegone_txt/original/', '../docs/map_resegone/original/', eps=30.0),
+            mapgen.MapJob('../docs/hiking_resegone_txt/filtered/', '../docs/map_resegone/filtered/', eps=30.0),
+            mapgen.MapJob('../docs/hiking_resegone_txt/splitted/', '../docs/map_resegone/splitted/', eps=50.0)
+        ], workers=3)
 
         g = MapGraph()
         g.map_to_graph('../docs/map_resegone/splitted/')
         g.paths_to_geom()
 
-        self.recommend_user(1, rs.Recommender.g_local_sim)
-        self.recommend_user(2, rs.Recommender.g_local_sim)
-        self.recommend_user(3, rs.Recommender.g_local_sim)
+        # Segments are read from GIS once, and shared by all the recommendations
+        segment_graph = SegmentGraph().load()
+        self.recommend_user(1, rs.Recommender.g_local_sim, segment_graph)
+        self.recommend_user(2, rs.Recommender.g_local_sim, segment_graph)
+        self.recommend_user(3, rs.Recommender.g_local_sim, segment_graph)
 
-        self.questionnaire_paths(1)
+        self.questionnaire_paths(1, segment_graph=segment_graph)
@@ -0,0 +1,267 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from preprocessing import projection
+
+# Nodes closer than SNAP_TOLERANCE (degrees) to an edge are considered on that edge, which is split at the node
+SNAP_TOLERANCE = 1e-8
+# UTM zone of the vertices written by the map construction algorithm
+UTM_ZONE_NUMBER = 32
+UTM_ZONE_LETTER = 'N'
+
+
+def _read_csv(filename, names, dtypes):
+    if os.path.getsize(filename) == 0:
+        return pd.DataFrame(dict((name, np.array([], dtype=dtypes[name])) for name in names), columns=names)
+    return pd.read_csv(filename, header=None, names=names, dtype=dtypes, engine='c', float_precision='round_trip')
+
+
+# Parse the vertices.txt and edges.txt files in directory (output of the map construction algorithm).
+# Returns the arrays (vertex ids, eastings, northings) and (edge start ids, edge end ids)
+def read_map_files(directory):
+    vertices = _read_csv(os.path.join(directory, 'vertices.txt'), ['id', 'easting', 'northing', 'altitude'],
+                         dict(id=np.int64, easting=np.float64, northing=np.float64, altitude=np.float64))
+    edges = _read_csv(os.path.join(directory, 'edges.txt'), ['id', 'start', 'end'],
+                      dict(id=np.int64, start=np.int64, end=np.int64))
+    return (vertices['id'].values, vertices['easting'].values, vertices['northing'].values), \
+        (edges['start'].values, edges['end'].values)
+
+
+# Edges to split because some nodes (other than their ends) are closer than tolerance to them. xs, ys: node
+# coordinates (longitude, latitude), starts, ends: node positions of the edges. Candidate edges of each node are
+# found with a grid: each edge is registered in the cells of points sampled along it (one per cell), and each
+# node is checked against the edges registered in its cell and in the neighbor ones.
+# Returns a dict edge -> nodes on it, ordered along the edge
+def find_edge_splits(xs, ys, starts, ends, tolerance=SNAP_TOLERANCE, block_size=1 << 22):
+    if not len(xs) or not len(starts):
+        return {}
+    xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    starts, ends = np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+    lengths = np.hypot(xs[ends] - xs[starts], ys[ends] - ys[starts])
+
+    # Cells as large as a typical edge, and at least twice the tolerance: a node within tolerance of an edge is
+    # then at most one cell away (on each axis) from the cell of a sample of the edge
+    min_x, min_y = xs.min(), ys.min()
+    extent = max(xs.max() - min_x, ys.max() - min_y)
+    cell = max(np.median(lengths), 2 * tolerance, extent / (1 << 30), 1e-12)
+    rows = int((ys.max() - min_y) // cell) + 3
+
+    def cell_keys(x, y):
+        return ((x - min_x) // cell).astype(np.int64) * rows + ((y - min_y) // cell).astype(np.int64) + rows + 1
+
+    samples = (np.ceil(lengths / cell) + 1).astype(np.int64)
+    sample_edges = np.repeat(np.arange(len(starts)), samples)
+    first_sample = np.cumsum(samples) - samples
+    fractions = (np.arange(len(sample_edges)) - first_sample[sample_edges]) / \
+        np.maximum(samples[sample_edges] - 1, 1).astype(np.float64)
+    sample_starts, sample_ends = starts[sample_edges], ends[sample_edges]
+    sample_keys = cell_keys(xs[sample_starts] + (xs[sample_ends] - xs[sample_starts]) * fractions,
+                            ys[sample_starts] + (ys[sample_ends] - ys[sample_starts]) * fractions)
+    order = np.lexsort((sample_edges, sample_keys))
+    sample_keys, sample_edges = sample_keys[order], sample_edges[order]
+    unique = np.ones(len(order), dtype=bool)
+    unique[1:] = (sample_keys[1:] != sample_keys[:-1]) | (sample_edges[1:] != sample_edges[:-1])
+    sample_keys, sample_edges = sample_keys[unique], sample_edges[unique]
+
+    # Candidate (node, edge) pairs: the edge is registered in the cell of the node or in a neighbor one.
+    # Pairs are generated and checked for blocks of nodes, so that at most about block_size pairs are in memory
+    node_keys = cell_keys(xs, ys)
+    offsets = [dx * rows + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+    lows = np.column_stack([np.searchsorted(sample_keys, node_keys + offset, 'left') for offset in offsets])
+    counts = np.column_stack([np.searchsorted(sample_keys, node_keys + offset, 'right')
+                              for offset in offsets]) - lows
+    node_pairs = np.cumsum(counts.sum(axis=1))
+
+    splits = {}  # edge -> [(position along the edge, node)]
+    first = 0
+    while first < len(xs):
+        last = max(first + 1, int(np.searchsorted(node_pairs, node_pairs[first] - counts[first].sum() + block_size,
+                                                  'right')))
+        pair_nodes, pair_edges = [], []
+        for k in range(len(offsets)):
+            low, count = lows[first:last, k], counts[first:last, k]
+            total = count.sum()
+            if total:
+                pair_nodes.append(np.repeat(np.arange(first, last), count))
+                pair_edges.append(sample_edges[np.repeat(low - (np.cumsum(count) - count), count) + np.arange(total)])
+        first = last
+        if not pair_nodes:
+            continue
+        pairs = np.unique(np.concatenate(pair_nodes) * len(starts) + np.concatenate(pair_edges))
+        pair_nodes, pair_edges = pairs // len(starts), pairs % len(starts)
+        keep = (pair_nodes != starts[pair_edges]) & (pair_nodes != ends[pair_edges])
+        pair_nodes, pair_edges = pair_nodes[keep], pair_edges[keep]
+
+        # Planar distance between node and edge (same of shapely distance, in degrees)
+        ax, ay = xs[starts[pair_edges]], ys[starts[pair_edges]]
+        dx, dy = xs[ends[pair_edges]] - ax, ys[ends[pair_edges]] - ay
+        px, py = xs[pair_nodes] - ax, ys[pair_nodes] - ay
+        squared_length = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(squared_length > 0, np.clip((px * dx + py * dy) / squared_length, 0, 1), 0)
+        on_edge = np.hypot(px - t * dx, py - t * dy) < tolerance
+
+        for e, position, n in zip(pair_edges[on_edge].tolist(), t[on_edge].tolist(),
+                                  pair_nodes[on_edge].tolist()):
+            splits.setdefault(e, []).append((position, n))
+    return dict((e, [n for _, n in sorted(on_nodes)]) for e, on_nodes in splits.items())
+
+
+# Undirected graph stored in compressed sparse row arrays. Nodes are positions 0..n-1 (node_ids keeps the ids of
+# the map files), edges are ids 0..m-1 with ends edge_starts[e] < edge_ends[e]. The neighbors of node i are
+# indices[indptr[i]:indptr[i + 1]], reached through the edges edge_ids[indptr[i]:indptr[i + 1]].
+# Self loops and repeated edges are dropped
+class CSRGraph:
+    ARRAYS = ('node_ids', 'latitudes', 'longitudes', 'indptr', 'indices', 'edge_ids', 'edge_starts', 'edge_ends')
+
+    def __init__(self, node_ids, latitudes, longitudes, indptr, indices, edge_ids, edge_starts, edge_ends):
+        self.node_ids = node_ids
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.indptr = indptr
+        self.indices = indices
+        self.edge_ids = edge_ids
+        self.edge_starts = edge_starts
+        self.edge_ends = edge_ends
+
+    # starts, ends: node positions of the edges
+    @staticmethod
+    def from_edges(node_ids, latitudes, longitudes, starts, ends):
+        n = len(node_ids)
+        starts, ends = np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+        lows, highs = np.minimum(starts, ends), np.maximum(starts, ends)
+        keys = np.unique((lows * n + highs)[lows != highs])
+        edge_starts, edge_ends = keys // n, keys % n
+
+        m = len(keys)
+        sources = np.concatenate((edge_starts, edge_ends))
+        order = np.argsort(sources, kind='mergesort')
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(sources, minlength=n))
+        indices = np.concatenate((edge_ends, edge_starts))[order]
+        edge_ids = np.concatenate((np.arange(m), np.arange(m)))[order]
+        return CSRGraph(np.asarray(node_ids, dtype=np.int64), np.asarray(latitudes, dtype=np.float64),
+                        np.asarray(longitudes, dtype=np.float64), indptr, indices, edge_ids, edge_starts, edge_ends)
+
+    # Same graph of MapGraph.map_to_graph (nodes sorted by id)
+    @staticmethod
+    def from_map_files(directory, tolerance=SNAP_TOLERANCE, zone_number=UTM_ZONE_NUMBER,
+                       zone_letter=UTM_ZONE_LETTER):
+        (node_ids, eastings, northings), (start_ids, end_ids) = read_map_files(directory)
+        order = np.argsort(node_ids, kind='mergesort')
+        node_ids, eastings, northings = node_ids[order], eastings[order], northings[order]
+        latitudes, longitudes = projection.from_utm(eastings, northings, zone_number, zone_letter)
+        graph = CSRGraph.from_edges(node_ids, latitudes, longitudes, np.searchsorted(node_ids, start_ids),
+                                    np.searchsorted(node_ids, end_ids))
+
+        # Split edges at the nodes that lie on them
+        splits = find_edge_splits(longitudes, latitudes, graph.edge_starts, graph.edge_ends, tolerance)
+        if not splits:
+            return graph
+        kept = np.ones(len(graph.edge_starts), dtype=bool)
+        kept[splits.keys()] = False
+        starts, ends = [graph.edge_starts[kept]], [graph.edge_ends[kept]]
+        for e, on_nodes in splits.items():
+            chain = [graph.edge_starts[e]] + on_nodes + [graph.edge_ends[e]]
+            starts.append(np.array(chain[:-1], dtype=np.int64))
+            ends.append(np.array(chain[1:], dtype=np.int64))
+        return CSRGraph.from_edges(node_ids, latitudes, longitudes, np.concatenate(starts), np.concatenate(ends))
+
+    # From a networkx graph with latitude and longitude node attributes (e.g. MapGraph.map_graph)
+    @staticmethod
+    def from_networkx(graph):
+        node_ids = np.array(sorted(graph.nodes()), dtype=np.int64)
+        latitudes = np.array([graph.node[node]['latitude'] for node in node_ids.tolist()], dtype=np.float64)
+        longitudes = np.array([graph.node[node]['longitude'] for node in node_ids.tolist()], dtype=np.float64)
+        edges = np.array(graph.edges(), dtype=np.int64).reshape(-1, 2)
+        return CSRGraph.from_edges(node_ids, latitudes, longitudes, np.searchsorted(node_ids, edges[:, 0]),
+                                   np.searchsorted(node_ids, edges[:, 1]))
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        return len(self.edge_starts)
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, node):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    # Maximal chains of degree 2 nodes (as MapGraph._get_segments_from_map), as lists of node positions.
+    # Every edge belongs to exactly one chain, walked from its intersection (or end) node with the lowest position
+    def chains(self):
+        indptr, indices, edge_ids = self.indptr.tolist(), self.indices.tolist(), self.edge_ids.tolist()
+        visited = bytearray(self.number_of_edges())
+
+        def walk(start, entry):
+            chain = [start]
+            while True:
+                visited[edge_ids[entry]] = 1
+                current = indices[entry]
+                chain.append(current)
+                if current == start or indptr[current + 1] - indptr[current] != 2:
+                    return chain
+                entry = next((k for k in range(indptr[current], indptr[current + 1]) if not visited[edge_ids[k]]),
+                             None)
+                if entry is None:
+                    return chain
+
+        chains = []
+        n = self.number_of_nodes()
+        for node in range(n):
+            if indptr[node + 1] - indptr[node] != 2:
+                for entry in range(indptr[node], indptr[node + 1]):
+                    if not visited[edge_ids[entry]]:
+                        chains.append(walk(node, entry))
+        # Remaining edges are in cycles of degree 2 nodes
+        for node in range(n):
+            for entry in range(indptr[node], indptr[node + 1]):
+                if not visited[edge_ids[entry]]:
+                    chains.append(walk(node, entry))
+        return chains
+
+    # Chains as (k, 2) arrays of longitude, latitude
+    def chain_coordinates(self):
+        return [np.column_stack((self.longitudes[chain], self.latitudes[chain])) for chain in self.chains()]
+
+    # Save the arrays (.npy files) in the directory path, replacing a previous snapshot
+    def save(self, path):
+        parent = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+
+        # Write to a temporary directory, then rename it, so that readers never see partial snapshots
+        tmp_dir = tempfile.mkdtemp(dir=parent)
+        for name in CSRGraph.ARRAYS:
+            np.save(os.path.join(tmp_dir, name + '.npy'), getattr(self, name))
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp_dir, path)
+
+    # Open a snapshot written by save. Arrays are memory-mapped (read only), so loading is almost instant and the
+    # pages are shared between the processes that open the same snapshot
+    @staticmethod
+    def load(path):
+        return CSRGraph(*[np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in CSRGraph.ARRAYS])
@@ -14,9 +14,51 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import os
+import subprocess
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
 import preprocessing.main as pp
 import writer.writer as w
-import subprocess
+from mapgenerator import tiling
+
+MAP_OUTPUTS = ('vertices.txt', 'edges.txt')
+
+# Seconds between two checks of a running job (for its end and its timeout)
+POLL_INTERVAL = 0.05
+
+
+# A run of the map construction algorithm. After MapGenerator.run_map_jobs, status is one of the STATUS values
+# and the other result attributes are set (returncode, stdout and stderr are None for skipped jobs)
+class MapJob:
+    DONE = 'done'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+    TIMEOUT = 'timeout'
+    STATUS = (DONE, SKIPPED, FAILED, TIMEOUT)
+
+    # timeout: seconds before the run is killed (None waits forever)
+    def __init__(self, input_path, output_path, eps=150.0, has_altitude=False, alt_eps=4.0, timeout=None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.eps = eps
+        self.has_altitude = has_altitude
+        self.alt_eps = alt_eps
+        self.timeout = timeout
+
+        self.status = None
+        self.returncode = None
+        self.stdout = None
+        self.stderr = None
+        self.wall_time = 0.0  # seconds
+        self.cpu_time = 0.0  # user + system seconds of the java process
+
+    def __repr__(self):
+        return 'MapJob({}, eps={}, status={}, wall={:.1f}s, cpu={:.1f}s)'.format(self.output_path, self.eps,
+                                                                             self.status, self.wall_time,
+                                                                             self.cpu_time)
 
 
 class MapGenerator:
@@ -24,28 +66,137 @@ class MapGenerator:
     def __init__(self):
         pass
 
-    def _execute_java(self, input_path, output_path, eps=150.0, has_altitude=False, alt_eps=4.0):
-        subprocess.call(args=['java',
-                              '-cp',
-                              '../bin/Ahmed/bin',
-                              'mapconstruction2.MapConstruction',
-                              input_path,
-                              output_path,
-                              str(eps),
-                              str(has_altitude),
-                              str(alt_eps)
-                              ])
-
-    def generate_segments_txts(self):
-        segments_original = pp.execute_no_gis('../docs/hiking_resegone/')
-        w.gpx_segments_to_utm_txt(segments_original, '../docs/hiking_resegone_txt/original/')
-
-        segments_filtered = pp.execute_filter_no_gis('../docs/hiking_resegone/')
-        w.gpx_segments_to_utm_txt(segments_filtered, '../docs/hiking_resegone_txt/filtered/')
-
-        segments_splitted_blocks = pp.execute_filter_split_no_gis('../docs/hiking_resegone/')
-        segments_splitted = [item for sublist in segments_splitted_blocks for item in sublist]
-        w.gpx_segments_to_utm_txt(segments_splitted, '../docs/hiking_resegone_txt/splitted/')
-
-    def generate_map_files(self, input_path, output_path, eps):
-        self._execute_java(input_path, output_path, eps=eps)
+    def _java_args(self, input_path, output_path, eps=150.0, has_altitude=False, alt_eps=4.0):
+        return ['java',
+                '-cp',
+                '../bin/Ahmed/bin',
+                'mapconstruction2.MapConstruction',
+                input_path,
+                output_path,
+                str(eps),
+                str(has_altitude),
+                str(alt_eps)
+                ]
+
+    # Outputs are up to date if all of them are newer than every file in the input directory.
+    # Parameters are not tracked: runs with different eps must use different output paths
+    def _is_up_to_date(self, job):
+        outputs = [os.path.join(job.output_path, name) for name in MAP_OUTPUTS]
+        if not all(os.path.isfile(output) for output in outputs):
+            return False
+        inputs = [os.path.join(job.input_path, name) for name in os.listdir(job.input_path)]
+        newest_input = max([os.path.getmtime(f) for f in inputs if os.path.isfile(f)] or [0])
+        return min(os.path.getmtime(output) for output in outputs) > newest_input
+
+    def _remove_outputs(self, job):
+        for name in MAP_OUTPUTS:
+            output = os.path.join(job.output_path, name)
+            if os.path.isfile(output):
+                os.remove(output)
+
+    # Outdated outputs are removed before the run, and outputs of failed or timed out runs after it, so that they
+    # are never taken as up to date
+    def _run_job(self, job):
+        if self._is_up_to_date(job):
+            job.status = MapJob.SKIPPED
+            return job
+        if not os.path.isdir(job.output_path):
+            os.makedirs(job.output_path)
+        self._remove_outputs(job)
+
+        # Output goes to temporary files, so that nothing blocks on full pipes
+        stdout, stderr = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+        try:
+            start = time.time()
+            process = subprocess.Popen(self._java_args(job.input_path, job.output_path, job.eps, job.has_altitude,
+                                                       job.alt_eps), stdout=stdout, stderr=stderr)
+            timed_out = False
+
+            # wait4 gives the resources used by this child only (jobs run concurrently). The process is polled and
+            # killed by this thread only before it is reaped, so a kill never hits a reused pid
+            while True:
+                pid, exit_status, usage = os.wait4(process.pid, os.WNOHANG)
+                if pid:
+                    break
+                if job.timeout is not None and not timed_out and time.time() - start > job.timeout:
+                    timed_out = True
+                    process.kill()
+                time.sleep(POLL_INTERVAL)
+            process.returncode = -os.WTERMSIG(exit_status) if os.WIFSIGNALED(exit_status) \
+                else os.WEXITSTATUS(exit_status)
+
+            job.wall_time = time.time() - start
+            job.cpu_time = usage.ru_utime + usage.ru_stime
+            job.returncode = process.returncode
+            stdout.seek(0)
+            stderr.seek(0)
+            job.stdout = stdout.read()
+            job.stderr = stderr.read()
+        finally:
+            stdout.close()
+            stderr.close()
+
+        if timed_out:
+            job.status = MapJob.TIMEOUT
+        elif job.returncode != 0:
+            job.status = MapJob.FAILED
+        else:
+            job.status = MapJob.DONE
+        if job.status != MapJob.DONE:
+            self._remove_outputs(job)
+        return job
+
+    # Run the map construction jobs on a pool of workers threads (each one waiting for its java process).
+    # workers: maximum number of concurrent runs (None means one per core). Returns the jobs, in the same order
+    def run_map_jobs(self, jobs, workers=None, verbose=True):
+        pool = ThreadPool(workers)
+        try:
+            for job in pool.imap_unordered(self._run_job, jobs):
+                if verbose:
+                    print job
+        finally:
+            pool.close()
+            pool.join()
+        return jobs
+
+    # A job for each eps value, each one writing in its own subdirectory of output_root
+    def eps_sweep_jobs(self, input_path, output_root, eps_values, timeout=None):
+        return [MapJob(input_path, os.path.join(output_root, 'eps_{}'.format(eps), ''), eps=eps, timeout=timeout)
+                for eps in eps_values]
+
+    # cache_dir: where parsed and filtered trajectories are cached between runs (None disables the cache).
+    # Files are parsed and filtered once: every export starts from the results of the previous stages
+    def generate_segments_txts(self, cache_dir=None):
+        dag = pp.preprocessing_pipeline('../docs/hiking_resegone/', cache_dir=cache_dir)
+        dag.stage('export_original',
+                  lambda segments: w.gpx_segments_to_utm_txt(segments, '../docs/hiking_resegone_txt/original/'),
+                  ['original'])
+        dag.stage('export_filtered',
+                  lambda segments: w.gpx_segments_to_utm_txt(segments, '../docs/hiking_resegone_txt/filtered/'),
+                  ['filtered'])
+        dag.stage('export_splitted',
+                  lambda blocks: w.gpx_segments_to_utm_txt([item for sublist in blocks for item in sublist],
+                                                           '../docs/hiking_resegone_txt/splitted/'),
+                  ['splitted'])
+        dag.run(['export_original', 'export_filtered', 'export_splitted'])
+
+    def generate_map_files(self, input_path, output_path, eps, timeout=None):
+        return self.run_map_jobs([MapJob(input_path, output_path, eps=eps, timeout=timeout)], workers=1)[0]
+
+    # Tiled map construction: trajectories are split in overlapping tiles (see tiling.tile_trajectories) that are
+    # processed in parallel, then tile maps are stitched in output_path (vertices.txt and edges.txt, as for
+    # generate_map_files). Tiles are kept in <output_path>/tiles/, so unchanged tiles are not processed again.
+    # overlap should be larger than eps. Returns the jobs of the tiles
+    def generate_tiled_map_files(self, input_path, output_path, eps, tile_size=tiling.TILE_SIZE,
+                                 overlap=tiling.OVERLAP, merge_distance=tiling.MERGE_DISTANCE, workers=None,
+                                 timeout=None):
+        tiles = tiling.tile_trajectories(input_path, os.path.join(output_path, 'tiles'), tile_size, overlap)
+        jobs = self.run_map_jobs([MapJob(tile.input_path, tile.output_path, eps=eps, timeout=timeout)
+                                  for tile in tiles], workers)
+        built = [tile for tile, job in zip(tiles, jobs) if job.status in (MapJob.DONE, MapJob.SKIPPED)]
+        if len(built) < len(tiles):
+            print '{} tiles of {} failed, their areas are missing from the map'.format(len(tiles) - len(built),
+                                                                                  len(tiles))
+        vertices, edges = tiling.stitch_tiles(built, output_path, merge_distance)
+        print 'Stitched map: {} vertices, {} edges'.format(vertices, edges)
+        return jobs
@@ -0,0 +1,163 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import glob
+import math
+import os
+
+import numpy as np
+
+import writer.writer as w
+
+# Tiles are squares of TILE_SIZE meters (UTM), extended by OVERLAP meters on each side
+TILE_SIZE = 5000.0
+OVERLAP = 500.0
+# Vertices of different tiles closer than MERGE_DISTANCE meters become the same vertex
+MERGE_DISTANCE = 10.0
+
+
+# A square of the UTM plane. The core is [min_x, max_x) x [min_y, max_y), trajectories are clipped to the core
+# extended by the overlap
+class Tile:
+
+    def __init__(self, column, row, tile_size, overlap, root):
+        self.column = column
+        self.row = row
+        self.min_x = column * tile_size
+        self.min_y = row * tile_size
+        self.max_x = self.min_x + tile_size
+        self.max_y = self.min_y + tile_size
+        self.overlap = overlap
+        self.input_path = os.path.join(root, 'tile_{}_{}'.format(column, row), 'input', '')
+        self.output_path = os.path.join(root, 'tile_{}_{}'.format(column, row), 'output', '')
+
+    def __repr__(self):
+        return 'Tile({}, {})'.format(self.column, self.row)
+
+    def in_core(self, x, y):
+        return (self.min_x <= x) & (x < self.max_x) & (self.min_y <= y) & (y < self.max_y)
+
+    def in_extent(self, x, y):
+        return (self.min_x - self.overlap <= x) & (x < self.max_x + self.overlap) & \
+               (self.min_y - self.overlap <= y) & (y < self.max_y + self.overlap)
+
+
+# Pieces (consecutive points, at least two) of a trajectory inside the extent of the tile
+def _clip(trajectory, tile):
+    inside = np.concatenate(([False], tile.in_extent(trajectory[:, 0], trajectory[:, 1]), [False]))
+    changes = np.flatnonzero(inside[1:] != inside[:-1])
+    pieces = []
+    for start, end in zip(changes[::2], changes[1::2]):
+        if end - start > 1:
+            pieces.append(trajectory[start:end])
+    return pieces
+
+
+# Split the trajectories (trip_*.txt files) of input_path in overlapping tiles, writing the pieces of each tile in
+# <tiles_root>/tile_<column>_<row>/input/. Unchanged tile inputs are not rewritten.
+# Returns the tiles with at least one trajectory
+def tile_trajectories(input_path, tiles_root, tile_size=TILE_SIZE, overlap=OVERLAP):
+    trajectories = [w.read_text_trajectory(f) for f in sorted(glob.glob(os.path.join(input_path, 'trip_*.txt')))]
+    trajectories = [t for t in trajectories if len(t)]
+
+    tiles = {}
+    for trajectory in trajectories:
+        # Candidate tiles are the ones whose extent overlaps the bounding box of the trajectory
+        min_column = int(math.floor((trajectory[:, 0].min() - overlap) / tile_size))
+        max_column = int(math.floor((trajectory[:, 0].max() + overlap) / tile_size))
+        min_row = int(math.floor((trajectory[:, 1].min() - overlap) / tile_size))
+        max_row = int(math.floor((trajectory[:, 1].max() + overlap) / tile_size))
+        for column in range(min_column, max_column + 1):
+            for row in range(min_row, max_row + 1):
+                if (column, row) not in tiles:
+                    tiles[(column, row)] = (Tile(column, row, tile_size, overlap, tiles_root), [])
+                tile, pieces = tiles[(column, row)]
+                pieces += _clip(trajectory, tile)
+
+    result = []
+    for key in sorted(tiles):
+        tile, pieces = tiles[key]
+        if pieces:
+            w.export_utm_trajectories([(p[:, 0], p[:, 1], p[:, 2]) for p in pieces], tile.input_path)
+            result.append(tile)
+    return result
+
+
+def _read_map(directory):
+    vertices = np.loadtxt(os.path.join(directory, 'vertices.txt'), delimiter=',', dtype=np.float64, ndmin=2)
+    edges = np.loadtxt(os.path.join(directory, 'edges.txt'), delimiter=',', dtype=np.int64, ndmin=2)
+    return vertices.reshape(-1, 4), edges.reshape(-1, 3)
+
+
+# Merge the maps built for each tile (vertices.txt and edges.txt in tile.output_path) in a single map, written in
+# output_path with the same format. Each edge is taken from the tile whose core contains its midpoint, so edges in
+# the overlap zones are not duplicated. Vertices of different tiles within merge_distance are merged, to connect
+# the edges that cross the tile borders
+def stitch_tiles(tiles, output_path, merge_distance=MERGE_DISTANCE):
+    coordinates = []  # (easting, northing, altitude) of stitched vertices
+    owners = []  # tile of each stitched vertex
+    grid = {}  # (cell x, cell y) -> stitched vertices in the cell
+    edges = []
+    edge_set = set()
+
+    def stitched_vertex(tile_index, x, y, altitude):
+        cell_x, cell_y = int(math.floor(x / merge_distance)), int(math.floor(y / merge_distance))
+        best, best_distance = None, merge_distance
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for candidate in grid.get((cell_x + dx, cell_y + dy), ()):
+                    if owners[candidate] == tile_index:
+                        continue
+                    distance = math.hypot(coordinates[candidate][0] - x, coordinates[candidate][1] - y)
+                    if distance <= best_distance:
+                        best, best_distance = candidate, distance
+        if best is not None:
+            return best
+        coordinates.append((x, y, altitude))
+        owners.append(tile_index)
+        grid.setdefault((cell_x, cell_y), []).append(len(coordinates) - 1)
+        return len(coordinates) - 1
+
+    for tile_index, tile in enumerate(tiles):
+        vertices, tile_edges = _read_map(tile.output_path)
+        if not len(vertices) or not len(tile_edges):
+            continue
+        rows = dict((int(vertex_id), i) for i, vertex_id in enumerate(vertices[:, 0].tolist()))
+        starts = vertices[[rows[v] for v in tile_edges[:, 1].tolist()]]
+        ends = vertices[[rows[v] for v in tile_edges[:, 2].tolist()]]
+        kept = tile.in_core((starts[:, 1] + ends[:, 1]) / 2, (starts[:, 2] + ends[:, 2]) / 2)
+
+        mapping = {}
+        for vertex_id in np.unique(tile_edges[kept][:, 1:]).tolist():
+            _, x, y, altitude = vertices[rows[vertex_id]].tolist()
+            mapping[vertex_id] = stitched_vertex(tile_index, x, y, altitude)
+        for _, start, end in tile_edges[kept].tolist():
+            edge = (mapping[start], mapping[end])
+            if edge[0] != edge[1] and edge not in edge_set:
+                edge_set.add(edge)
+                edges.append(edge)
+
+    # Only vertices used by edges are written, with new consecutive ids
+    used = sorted(set(v for edge in edges for v in edge))
+    new_ids = dict((v, i) for i, v in enumerate(used))
+    if not os.path.isdir(output_path):
+        os.makedirs(output_path)
+    with open(os.path.join(output_path, 'vertices.txt'), 'w') as vertices_file:
+        vertices_file.write(''.join('{},{},{},{}\n'.format(new_ids[v], *coordinates[v]) for v in used))
+    with open(os.path.join(output_path, 'edges.txt'), 'w') as edges_file:
+        edges_file.write(''.join('{},{},{}\n'.format(i, new_ids[start], new_ids[end])
+                                 for i, (start, end) in enumerate(edges)))
+    return len(used), len(edges)
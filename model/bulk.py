@@ -0,0 +1,321 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import struct
+import sys
+
+from sqlalchemy import distinct
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy import union_all
+from sqlalchemy.schema import CreateTable
+
+import model
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+
+
+# Encode rows in the binary COPY format. types: one of 'int4', 'float8', 'text', 'wkb' for each column
+def _copy_binary_buffer(rows, types):
+    buf = io.BytesIO()
+    buf.write(PGCOPY_HEADER)
+    field_count = struct.pack('>h', len(types))
+    for row in rows:
+        buf.write(field_count)
+        for value, value_type in zip(row, types):
+            if value is None:
+                buf.write(struct.pack('>i', -1))
+                continue
+            if value_type == 'int4':
+                data = struct.pack('>i', value)
+            elif value_type == 'float8':
+                data = struct.pack('>d', value)
+            elif value_type == 'text':
+                data = value.encode('utf-8') if isinstance(value, unicode) else value
+            else:
+                data = bytes(value)
+            buf.write(struct.pack('>i', len(data)))
+            buf.write(data)
+    buf.write(PGCOPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+# Segment ends are snapped to a grid of SNAP_GRID degrees to find the nodes they share (segment_node_py)
+SNAP_GRID = 1e-9
+
+# Geodesic length and label rates (in model.LABELS order, 0 for missing labels) of the new segments
+SEGMENT_LENGTH = 'UPDATE {segment} SET length = ST_Length(geom::geography) WHERE length IS NULL'
+SEGMENT_PROPERTIES = '''UPDATE {segment} s SET properties = ARRAY(
+           SELECT COALESCE((SELECT l.label_rate FROM {label} l WHERE l.segment_id = s.id AND l.label = p.label
+                            ORDER BY l.id DESC LIMIT 1), 0)
+           FROM unnest(ARRAY[{properties}]::text[]) WITH ORDINALITY AS p(label, i) ORDER BY p.i)
+       WHERE properties IS NULL'''
+# Same, when there is no label table
+SEGMENT_EMPTY_PROPERTIES = 'UPDATE {segment} SET properties = array_fill(0::float8, ARRAY[{size}]) ' \
+                           'WHERE properties IS NULL'
+
+# Columns of segment_py added after the first release (a segment_py restored from postgis_dump has none of them)
+SEGMENT_COLUMNS = [('source', 'varchar'), ('length', 'float8'), ('start_node', 'integer'), ('end_node', 'integer'),
+                   ('properties', 'float8[]')]
+
+# Nodes of the ends of the new segments (start_node still NULL): ends not matching the key of an existing node get a
+# new node (numbered after the existing ones, in the order of their snapped ends), then the new segments get the node
+# ids of their ends and the degrees of their nodes are increased. Nodes and node ids of older segments are kept
+SEGMENT_TOPOLOGY = [
+    '''WITH ends AS (
+           SELECT ST_AsBinary(ST_SnapToGrid(ST_StartPoint(geom), {grid!r})) AS key FROM {segment}
+           WHERE start_node IS NULL
+           UNION SELECT ST_AsBinary(ST_SnapToGrid(ST_EndPoint(geom), {grid!r})) FROM {segment}
+           WHERE start_node IS NULL)
+       INSERT INTO {node} (id, key, geom, degree)
+       SELECT (SELECT COALESCE(MAX(id), 0) FROM {node}) + row_number() OVER (ORDER BY key), key, ST_GeomFromWKB(key), 0
+       FROM ends
+       WHERE key IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {node} n WHERE n.key = ends.key)''',
+    '''WITH assigned AS (
+           UPDATE {segment} s SET start_node = start_nodes.id, end_node = end_nodes.id
+           FROM {node} start_nodes, {node} end_nodes
+           WHERE s.start_node IS NULL
+             AND start_nodes.key = ST_AsBinary(ST_SnapToGrid(ST_StartPoint(s.geom), {grid!r}))
+             AND end_nodes.key = ST_AsBinary(ST_SnapToGrid(ST_EndPoint(s.geom), {grid!r}))
+           RETURNING s.id, s.start_node, s.end_node),
+       degrees AS (
+           SELECT node, count(DISTINCT id) AS degree
+           FROM (SELECT start_node AS node, id FROM assigned UNION ALL SELECT end_node, id FROM assigned) AS ends
+           GROUP BY node)
+       UPDATE {node} n SET degree = n.degree + degrees.degree FROM degrees WHERE n.id = degrees.node''']
+
+
+# Delete the segments matching condition (a clause on model.Segment) and their labels, taking them off the degrees of
+# their nodes. Nodes left without segments are kept (degree 0), so that segments added back get the same node ids
+def delete_segments(connection, condition):
+    segment = model.Segment.__table__
+    node = model.SegmentNode.__table__
+    deleted = select([segment.c.id]).where(condition)
+    if model.Label.__table__.exists(connection):
+        connection.execute(model.Label.__table__.delete().where(model.Label.segment_id.in_(deleted)))
+    if node.exists(connection):
+        ends = union_all(select([segment.c.start_node.label('node'), segment.c.id]).where(condition),
+                         select([segment.c.end_node, segment.c.id]).where(condition)).alias('ends')
+        degrees = select([ends.c.node, func.count(distinct(ends.c.id)).label('degree')]) \
+            .group_by(ends.c.node).alias('degrees')
+        connection.execute(node.update().where(node.c.id == degrees.c.node)
+                           .values(degree=node.c.degree - degrees.c.degree))
+    connection.execute(segment.delete().where(condition))
+
+
+# Load segments (and their labels) into segment_py and segment_label_py in batches, with COPY ... (FORMAT binary)
+# when the driver is psycopg2, or with multi-row executemany otherwise. Geometries are passed as binary WKB.
+# Each batch is committed on its own, so a failure only loses the current batch. Indexes are dropped during the load
+# and built when it is done (rebuild_indexes=False keeps them: better when only a few rows are added to a big table).
+# Missing indexes are always built at the end of the load, so that tables created by an incremental load get them.
+# Segment attributes (length, label rates) and the segment topology (nodes of the segment ends) are computed by
+# the database at the end of the load.
+class BulkLoader:
+    geom_index = 'idx_segment_py_geom'
+    geography_index = 'idx_segment_py_geography'  # for ST_DWithin on geography(geom) (spheroid distances in meters)
+    label_index = 'idx_segment_label_py_segment_id'
+    node_indexes = ['idx_segment_py_start_node', 'idx_segment_py_end_node']
+
+    def __init__(self, engine, batch_size=5000, verbose=True, rebuild_indexes=True):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.rebuild_indexes = rebuild_indexes
+
+    def _next_id(self, cursor, table):
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM {}'.format(table))
+        return cursor.fetchone()[0] + 1
+
+    def _copy(self, cursor, table, columns, types, rows):
+        if hasattr(cursor, 'copy_expert'):
+            cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT binary)'.format(table, ', '.join(columns)),
+                               _copy_binary_buffer(rows, types))
+        else:
+            values = ', '.join('ST_GeomFromWKB(%s)' if t == 'wkb' else '%s' for t in types)
+            cursor.executemany('INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns), values),
+                               [tuple(bytearray(v) if t == 'wkb' else v for v, t in zip(row, types)) for row in rows])
+
+    def _drop_indexes(self, cursor):
+        cursor.execute('DROP INDEX IF EXISTS {}'.format(self.geom_index))
+        cursor.execute('DROP INDEX IF EXISTS {}'.format(self.geography_index))
+        cursor.execute('DROP INDEX IF EXISTS {}'.format(self.label_index))
+        for index in self.node_indexes:
+            cursor.execute('DROP INDEX IF EXISTS {}'.format(index))
+
+    def _create_indexes(self, cursor):
+        cursor.execute('CREATE INDEX IF NOT EXISTS {} ON {} USING GIST (geom)'.format(self.geom_index,
+                                                                                     model.Segment.__tablename__))
+        cursor.execute('CREATE INDEX IF NOT EXISTS {} ON {} USING GIST (geography(geom))'.format(
+            self.geography_index, model.Segment.__tablename__))
+        cursor.execute('CREATE INDEX IF NOT EXISTS {} ON {} (segment_id)'.format(self.label_index,
+                                                                                model.Label.__tablename__))
+        for index, column in zip(self.node_indexes, ['start_node', 'end_node']):
+            cursor.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(index, model.Segment.__tablename__,
+                                                                            column))
+
+    def _columns(self, cursor, table):
+        cursor.execute('SELECT column_name FROM information_schema.columns WHERE table_name = %s', (table,))
+        return set(row[0] for row in cursor.fetchall())
+
+    # Add the columns missing in an older segment_py (looked up in the catalog, as ADD COLUMN IF NOT EXISTS needs
+    # PostgreSQL 9.6 and the dump is 9.5) and the node table. Nodes without key (first node table) are rebuilt
+    def _upgrade_tables(self, cursor):
+        segment = model.Segment.__tablename__
+        node = model.SegmentNode.__tablename__
+        columns = self._columns(cursor, segment)
+        for column, column_type in SEGMENT_COLUMNS:
+            if column not in columns:
+                cursor.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(segment, column, column_type))
+        cursor.execute('CREATE INDEX IF NOT EXISTS ix_{0}_source ON {0} (source)'.format(segment))
+        node_columns = self._columns(cursor, node)
+        if node_columns and 'key' not in node_columns:
+            cursor.execute('DROP TABLE {}'.format(node))
+            cursor.execute('UPDATE {} SET start_node = NULL, end_node = NULL'.format(segment))
+            node_columns = None
+        if not node_columns:
+            cursor.execute(str(CreateTable(model.SegmentNode.__table__).compile(dialect=self.engine.dialect)))
+
+    def _update_segments(self, cursor):
+        names = dict(segment=model.Segment.__tablename__, label=model.Label.__tablename__,
+                     node=model.SegmentNode.__tablename__, grid=SNAP_GRID, size=len(model.LABELS),
+                     properties=', '.join("'{}'".format(label) for label in model.LABELS))
+        cursor.execute("SELECT to_regclass('{}')".format(model.Label.__tablename__))
+        properties = SEGMENT_PROPERTIES if cursor.fetchone()[0] is not None else SEGMENT_EMPTY_PROPERTIES
+        for statement in [SEGMENT_LENGTH, properties] + SEGMENT_TOPOLOGY:
+            cursor.execute(statement.format(**names))
+
+    def _finish(self, cursor):
+        self._update_segments(cursor)
+        self._create_indexes(cursor)
+        # Keep serial columns consistent with the ids assigned here
+        for table in [model.Segment.__tablename__, model.Label.__tablename__]:
+            cursor.execute("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                           "(SELECT COALESCE(MAX(id), 0) + 1 FROM {0}), false)".format(table))
+        cursor.execute('ANALYZE {}'.format(model.Segment.__tablename__))
+        cursor.execute('ANALYZE {}'.format(model.Label.__tablename__))
+        cursor.execute('ANALYZE {}'.format(model.SegmentNode.__tablename__))
+
+    def _load_batch(self, cursor, batch, segment_id, label_id):
+        segment_rows = []
+        label_rows = []
+        for row in batch:
+            name, wkb, labels = row[:3]
+            segment_rows.append((segment_id, name, wkb, row[3] if len(row) > 3 else None))
+            for label, label_rate in labels:
+                label_rows.append((label_id, label, label_rate, segment_id))
+                label_id += 1
+            segment_id += 1
+        self._copy(cursor, model.Segment.__tablename__, ['id', 'name', 'geom', 'source'],
+                   ['int4', 'text', 'wkb', 'text'], segment_rows)
+        if label_rows:
+            self._copy(cursor, model.Label.__tablename__, ['id', 'label', 'label_rate', 'segment_id'],
+                       ['int4', 'text', 'float8', 'int4'], label_rows)
+        return segment_id, label_id, len(label_rows)
+
+    # segments: iterable of (name, wkb, labels[, source]), where wkb is the binary WKB of the geometry,
+    # labels a list of (label, label_rate) and source the file the segment comes from.
+    # Returns the number of segments loaded
+    def load_segments(self, segments):
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            self._upgrade_tables(cursor)
+            if self.rebuild_indexes:
+                self._drop_indexes(cursor)
+            segment_id = self._next_id(cursor, model.Segment.__tablename__)
+            label_id = self._next_id(cursor, model.Label.__tablename__)
+            connection.commit()
+
+            loaded_segments = loaded_labels = 0
+            batch = []
+            for segment in segments:
+                batch.append(segment)
+                if len(batch) == self.batch_size:
+                    segment_id, label_id, n_labels = self._load_batch(cursor, batch, segment_id, label_id)
+                    connection.commit()
+                    loaded_segments += len(batch)
+                    loaded_labels += n_labels
+                    batch = []
+                    if self.verbose:
+                        print '{} segments, {} labels loaded'.format(loaded_segments, loaded_labels)
+            if batch:
+                segment_id, label_id, n_labels = self._load_batch(cursor, batch, segment_id, label_id)
+                connection.commit()
+                loaded_segments += len(batch)
+                loaded_labels += n_labels
+
+            if self.verbose:
+                print '{} segments, {} labels loaded'.format(loaded_segments, loaded_labels)
+            self._finish(cursor)
+            connection.commit()
+            return loaded_segments
+        except Exception:
+            exc_info = sys.exc_info()
+            connection.rollback()
+            # Batches already committed are kept: restore their indexes before giving up
+            try:
+                self._finish(connection.cursor())
+                connection.commit()
+            except Exception:
+                connection.rollback()
+            raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            connection.close()
+
+
+# Upgrade in place the segments of an older release (e.g. the database restored from postgis_dump), without
+# rebuilding it: the missing columns, node table and indexes are added, and length, label rates and nodes of the
+# existing segments are computed. Segments and labels are kept as they are. Nothing is done without segment_py.
+# Run it once after restoring an older database (loads upgrade the tables they write to by themselves)
+def upgrade_schema(engine):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT to_regclass('{}')".format(model.Segment.__tablename__))
+        if cursor.fetchone()[0] is not None:
+            loader = BulkLoader(engine, verbose=False)
+            loader._upgrade_tables(cursor)
+            loader._finish(cursor)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+# Columns of this release missing in segment_py and segment_node_py (all of them when the tables do not exist)
+def missing_columns(engine):
+    segment = model.Segment.__tablename__
+    node = model.SegmentNode.__tablename__
+    rows = engine.execute(text('SELECT table_name, column_name FROM information_schema.columns '
+                               'WHERE table_name IN (:segment, :node)'), segment=segment, node=node)
+    columns = set((row[0], row[1]) for row in rows)
+    required = [(segment, column) for column, _ in SEGMENT_COLUMNS] + [(node, 'key')]
+    return ['{}.{}'.format(table, column) for table, column in required if (table, column) not in columns]
+
+
+# Check (without changing the database) that the segments have the schema of this release, for the code that only
+# reads them. Raises a RuntimeError telling how to upgrade the database otherwise
+def check_schema(engine):
+    missing = missing_columns(engine)
+    if missing:
+        raise RuntimeError('The segment tables are out of date (missing {}): run model.bulk.upgrade_schema on the '
+                           'database once, or load the segments again'.format(', '.join(missing)))
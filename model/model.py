@@ -15,27 +15,71 @@ limitations under the License.
 """
 
 from geoalchemy2 import Geometry
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, LargeBinary
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
 
+# Registry of the segment labels: the position of a label is its column in the property vectors (Segment.properties,
+# recommendation.properties.PropertyMatrix) and in the user profiles. Labels not registered are ignored
+class LabelVocabulary:
+
+    def __init__(self, labels=()):
+        self.labels = []
+        self.indices = {}
+        for label in labels:
+            self.register(label)
+
+    # Add a label (if new), returns its position
+    def register(self, label):
+        if label not in self.indices:
+            self.indices[label] = len(self.labels)
+            self.labels.append(label)
+        return self.indices[label]
+
+    def index(self, label):
+        return self.indices[label]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    # Property vector of (label, label_rate) pairs. When a label is repeated, the last rate is kept
+    def vector(self, labels):
+        vector = [0] * len(self.labels)
+        for label, label_rate in labels:
+            if label in self.indices:
+                vector[self.indices[label]] = label_rate
+        return vector
+
+
+LABELS = LabelVocabulary(['rock', 'dirt', 'woodland', 'asphalt'])
+
+
 # ORM mapping with segment table
 class Segment(Base):
     __tablename__ = 'segment_py'
     id = Column(Integer, primary_key=True)
     name = Column(String)
     geom = Column(Geometry())
+    source = Column(String, index=True)  # gpx file the segment comes from (None for segments of the map)
     labels = relationship('Label', back_populates="segment")
-    length = 0
+    # Computed at ingestion (see bulk.BulkLoader)
+    length = Column(Float)  # meters (geodesic)
+    start_node = Column(Integer)  # segment_node_py ids of the ends
+    end_node = Column(Integer)
+    properties = Column(ARRAY(Float))  # label rates, in LABELS order
+    origin_id = None  # for temporary segments (pieces of a segment): id of the segment
 
     def get_properties_vector(self):
-        d = {'rock': 0, 'dirt': 0, 'woodland': 0, 'asphalt': 0}
-        for label in self.labels:
-            d[label.label] = label.label_rate
-        return [d['rock'], d['dirt'], d['woodland'], d['asphalt']]
+        if self.properties is not None:
+            return list(self.properties) + [0] * (len(LABELS) - len(self.properties))
+        return LABELS.vector((label.label, label.label_rate) for label in self.labels)
 
 
 class Label(Base):
@@ -47,6 +91,26 @@ class Label(Base):
     segment = relationship("Segment", back_populates="labels")
 
 
+# Ends of the segments of segment_py, snapped to a grid of bulk.SNAP_GRID degrees: segments with an end in the same
+# node are connected. degree is the number of segments touching the node. Nodes are added (and degrees updated) for
+# the new segments of each load, existing nodes keep their ids (see bulk.BulkLoader, bulk.delete_segments)
+class SegmentNode(Base):
+    __tablename__ = 'segment_node_py'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    key = Column(LargeBinary, unique=True)  # WKB of the snapped point (see bulk.SNAP_GRID)
+    geom = Column(Geometry('POINT'))
+    degree = Column(Integer)
+
+
+# Manifest of the gpx files ingested in segment_py (see preprocessing.main.execute_with_gis)
+class IngestedFile(Base):
+    __tablename__ = 'ingested_file_py'
+    id = Column(Integer, primary_key=True)
+    path = Column(String, unique=True)
+    file_hash = Column(String)
+    parameters = Column(String)  # preprocessing parameters (json)
+
+
 class User(Base):
     __tablename__ = 'user_py'
     id = Column(Integer, primary_key=True)
@@ -57,8 +121,9 @@ class User(Base):
     ranking_list = []
     survey_time = 0.
 
+    # Preferences in LABELS order
     def get_profile(self):
-        return [self.rock, self.dirt, self.woodland, self.asphalt]
+        return [getattr(self, label) for label in LABELS]
 
 
 class Path(Base):
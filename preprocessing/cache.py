@@ -0,0 +1,128 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from receiver.reader import ArraySegment
+
+COLUMNS = ['latitude', 'longitude', 'elevation', 'time']
+
+
+# Hash (hex) of the content of a file
+def file_hash(filename, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            h.update(block)
+            block = f.read(block_size)
+    return h.hexdigest()
+
+
+# On-disk cache of the segments obtained from a gpx file by a preprocessing stage.
+# Each entry is a directory with one .npy file per column (all segments concatenated) plus the segments offsets,
+# and it is loaded by memory-mapping. Entries are keyed by the hash of the file and by the stage parameters, so
+# an entry is never used after the file or the parameters change (and it is removed as soon as a new one is stored).
+class TrajectoryCache:
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._hashes = {}  # (path, mtime, size) -> hash, to avoid hashing the same file for every stage
+
+    def _file_hash(self, filename):
+        stat = os.stat(filename)
+        fingerprint = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+        if fingerprint not in self._hashes:
+            self._hashes[fingerprint] = file_hash(filename)
+        return self._hashes[fingerprint]
+
+    def _file_dir(self, filename):
+        return os.path.join(self.cache_dir, hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest())
+
+    def _entry_name(self, filename, stage, params):
+        key = hashlib.sha1(self._file_hash(filename))
+        key.update(stage)
+        key.update(json.dumps(sorted((params or {}).items())))
+        return '{}-{}'.format(stage, key.hexdigest())
+
+    # Return the cached segments (list of ArraySegment), or None if there is no valid entry
+    def load(self, filename, stage, params=None):
+        entry_dir = os.path.join(self._file_dir(filename), self._entry_name(filename, stage, params))
+        if not os.path.isdir(entry_dir):
+            return None
+
+        with open(os.path.join(entry_dir, 'segments.json'), 'r') as meta_file:
+            meta = json.load(meta_file)
+        columns = {}
+        for column in COLUMNS:
+            columns[column] = np.load(os.path.join(entry_dir, column + '.npy'), mmap_mode='r')
+        offsets = np.load(os.path.join(entry_dir, 'offsets.npy'))
+
+        segments = []
+        for i, segment_meta in enumerate(meta):
+            start, end = offsets[i], offsets[i + 1]
+            segment = ArraySegment(*[columns[column][start:end] for column in COLUMNS],
+                                   track_name=segment_meta['track_name'],
+                                   filename=filename,
+                                   track_index=segment_meta['track_index'],
+                                   segment_index=segment_meta['segment_index'])
+            segment.group = segment_meta['group']
+            segments.append(segment)
+        return segments
+
+    # Store segments (list of ArraySegment) as the entry of filename for stage, replacing older entries.
+    # Segments may have a group attribute (e.g. index of the original segment they were split from)
+    def store(self, filename, stage, segments, params=None):
+        file_dir = self._file_dir(filename)
+        entry_name = self._entry_name(filename, stage, params)
+        if not os.path.isdir(file_dir):
+            os.makedirs(file_dir)
+
+        # Write to a temporary directory, then rename it, so that readers never see partial entries
+        tmp_dir = tempfile.mkdtemp(dir=file_dir)
+        offsets = np.cumsum([0] + [len(segment) for segment in segments]).astype(np.int64)
+        np.save(os.path.join(tmp_dir, 'offsets.npy'), offsets)
+        for column in COLUMNS:
+            values = [np.asarray(getattr(segment, column), dtype=np.float64) for segment in segments]
+            np.save(os.path.join(tmp_dir, column + '.npy'),
+                    np.concatenate(values) if values else np.empty(0, dtype=np.float64))
+        meta = [dict(track_name=segment.track_name,
+                     track_index=segment.track_index,
+                     segment_index=segment.segment_index,
+                     group=getattr(segment, 'group', None)) for segment in segments]
+        with open(os.path.join(tmp_dir, 'segments.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+        # Invalidate entries of this stage computed from a different content or with different parameters
+        for name in os.listdir(file_dir):
+            if name.startswith(stage + '-'):
+                shutil.rmtree(os.path.join(file_dir, name))
+        os.rename(tmp_dir, os.path.join(file_dir, entry_name))
+
+    # Return the cached segments of filename for stage, computing (and storing) them with compute(filename) if needed
+    def get(self, filename, stage, compute, params=None):
+        segments = self.load(filename, stage, params)
+        if segments is None:
+            segments = compute(filename)
+            self.store(filename, stage, segments, params)
+            segments = self.load(filename, stage, params)
+        return segments
@@ -0,0 +1,207 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import division
+
+import math
+import timeit
+
+import numpy as np
+
+# Allowed methods, from the fastest to the most accurate
+GPXPY = 'gpxpy'  # flat approximation used by gpxpy's length_2d (haversine over .2 degrees)
+HAVERSINE = 'haversine'  # sphere with the mean earth radius
+ANDOYER = 'andoyer'  # Andoyer-Lambert first order approximation on the WGS-84 ellipsoid
+VINCENTY = 'vincenty'  # Vincenty's inverse formula on the WGS-84 ellipsoid (as geopy's vincenty)
+KARNEY = 'karney'  # Karney's algorithm (geographiclib). Exact, but not vectorized: use it as reference
+
+WGS84_MAJOR = 6378137.0
+WGS84_MINOR = 6356752.3142
+WGS84_FLATTENING = 1 / 298.257223563
+MEAN_EARTH_RADIUS = 6371008.8
+
+
+# Distances (in meters) between (lat1, lon1) and (lat2, lon2), element by element. Arguments are broadcast,
+# so a single point can be compared with many points
+def between(lat1, lon1, lat2, lon2, method=VINCENTY):
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*[np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2)])
+    if method == GPXPY:
+        return gpxpy_flat(lat1, lon1, lat2, lon2)
+    elif method == HAVERSINE:
+        return haversine(lat1, lon1, lat2, lon2)
+    elif method == ANDOYER:
+        return andoyer(lat1, lon1, lat2, lon2)
+    elif method == VINCENTY:
+        return vincenty(lat1, lon1, lat2, lon2)
+    elif method == KARNEY:
+        return karney(lat1, lon1, lat2, lon2)
+    raise ValueError('Unknown distance method: {}'.format(method))
+
+
+# Distances (in meters) between consecutive points of a track (from each point to the previous one)
+def pairwise(latitudes, longitudes, method=VINCENTY):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    return between(latitudes[1:], longitudes[1:], latitudes[:-1], longitudes[:-1], method)
+
+
+# Distances (in meters) from one point to many points
+def to_many(latitude, longitude, latitudes, longitudes, method=VINCENTY):
+    return between(latitude, longitude, latitudes, longitudes, method)
+
+
+# Same result of gpxpy.geo.distance (2d), where lat1/lon1 is the point the distance is computed from
+def gpxpy_flat(lat1, lon1, lat2, lon2):
+    earth_radius = 6378.137 * 1000
+    one_degree = (2 * math.pi * earth_radius) / 360
+
+    x = lat1 - lat2
+    y = (lon1 - lon2) * np.cos(lat1 / 180. * math.pi)
+    distances = np.sqrt(x * x + y * y) * one_degree
+
+    far = (np.abs(x) > .2) | (np.abs(lon1 - lon2) > .2)
+    if np.any(far):
+        d_lat = np.radians(lat1[far] - lat2[far])
+        d_lon = np.radians(lon1[far] - lon2[far])
+        a = np.sin(d_lat / 2) ** 2 + \
+            np.sin(d_lon / 2) ** 2 * np.cos(np.radians(lat1[far])) * np.cos(np.radians(lat2[far]))
+        distances[far] = earth_radius * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return distances
+
+
+def haversine(lat1, lon1, lat2, lon2, radius=MEAN_EARTH_RADIUS):
+    d_lat = np.radians(lat2 - lat1)
+    d_lon = np.radians(lon2 - lon1)
+    a = np.sin(d_lat / 2) ** 2 + np.sin(d_lon / 2) ** 2 * np.cos(np.radians(lat1)) * np.cos(np.radians(lat2))
+    return radius * 2 * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+
+# Equirectangular approximation. Accurate within a few 0.1% for points that are close (as in SPT checks)
+def equirectangular(lat1, lon1, lat2, lon2, radius=MEAN_EARTH_RADIUS):
+    x = np.radians(lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2))
+    y = np.radians(lat2 - lat1)
+    return np.sqrt(x * x + y * y) * radius
+
+
+# Andoyer-Lambert: spherical distance corrected for the flattening of the ellipsoid. No iterations
+def andoyer(lat1, lon1, lat2, lon2):
+    f = WGS84_FLATTENING
+    big_f = np.radians(lat1 + lat2) / 2
+    g = np.radians(lat1 - lat2) / 2
+    l = np.radians(lon1 - lon2) / 2
+
+    sin_g, cos_g = np.sin(g) ** 2, np.cos(g) ** 2
+    sin_f, cos_f = np.sin(big_f) ** 2, np.cos(big_f) ** 2
+    sin_l, cos_l = np.sin(l) ** 2, np.cos(l) ** 2
+
+    s = sin_g * cos_l + cos_f * sin_l
+    c = cos_g * cos_l + sin_f * sin_l
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = np.arctan(np.sqrt(s / c))
+        r = np.sqrt(s * c) / w
+        h1 = (3 * r - 1) / (2 * c)
+        h2 = (3 * r + 1) / (2 * s)
+        distances = 2 * w * WGS84_MAJOR * (1 + f * h1 * sin_f * cos_g - f * h2 * cos_f * sin_g)
+    return np.where(s == 0, 0., distances)
+
+
+# Vincenty distance (in meters) on the WGS-84 ellipsoid, as computed by geopy's vincenty.
+# Returns nan where the formula does not converge (nearly antipodal points)
+def vincenty(lat1, lon1, lat2, lon2, iterations=20):
+    # Same constants (and units) of geopy, so that results are the same up to the last digits
+    major, minor, f = 6378.137, 6356.7523142, 1 / 298.257223563
+
+    delta_lng = np.radians(lon2) - np.radians(lon1)
+    reduced_lat1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    reduced_lat2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_reduced1, cos_reduced1 = np.sin(reduced_lat1), np.cos(reduced_lat1)
+    sin_reduced2, cos_reduced2 = np.sin(reduced_lat2), np.cos(reduced_lat2)
+
+    lambda_lng = delta_lng
+    sin_sigma = cos_sigma = sigma = cos_sq_alpha = cos2_sigma_m = np.zeros_like(delta_lng)
+    active = np.ones(delta_lng.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(iterations + 1):
+            sin_lambda_lng, cos_lambda_lng = np.sin(lambda_lng), np.cos(lambda_lng)
+            new_sin_sigma = np.sqrt((cos_reduced2 * sin_lambda_lng) ** 2 +
+                                    (cos_reduced1 * sin_reduced2 - sin_reduced1 * cos_reduced2 * cos_lambda_lng) ** 2)
+            new_cos_sigma = sin_reduced1 * sin_reduced2 + cos_reduced1 * cos_reduced2 * cos_lambda_lng
+            new_sigma = np.arctan2(new_sin_sigma, new_cos_sigma)
+            sin_alpha = cos_reduced1 * cos_reduced2 * sin_lambda_lng / new_sin_sigma
+            new_cos_sq_alpha = 1 - sin_alpha ** 2
+            new_cos2_sigma_m = np.where(new_cos_sq_alpha != 0,
+                                        new_cos_sigma - 2 * (sin_reduced1 * sin_reduced2 / new_cos_sq_alpha), 0.)
+            c = f / 16. * new_cos_sq_alpha * (4 + f * (4 - 3 * new_cos_sq_alpha))
+            new_lambda_lng = delta_lng + (1 - c) * f * sin_alpha * (new_sigma + c * new_sin_sigma * (
+                new_cos2_sigma_m + c * new_cos_sigma * (-1 + 2 * new_cos2_sigma_m ** 2)))
+
+            # Only not yet converged pairs are updated
+            sin_sigma = np.where(active, new_sin_sigma, sin_sigma)
+            cos_sigma = np.where(active, new_cos_sigma, cos_sigma)
+            sigma = np.where(active, new_sigma, sigma)
+            cos_sq_alpha = np.where(active, new_cos_sq_alpha, cos_sq_alpha)
+            cos2_sigma_m = np.where(active, new_cos2_sigma_m, cos2_sigma_m)
+            converged = np.abs(new_lambda_lng - lambda_lng) <= 10e-12
+            lambda_lng = np.where(active, new_lambda_lng, lambda_lng)
+            active &= ~converged & (new_sin_sigma != 0)
+            if not np.any(active):
+                break
+
+        u_sq = cos_sq_alpha * (major ** 2 - minor ** 2) / minor ** 2
+        a = 1 + u_sq / 16384. * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        b = u_sq / 1024. * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = b * sin_sigma * (cos2_sigma_m + b / 4. * (
+            cos_sigma * (-1 + 2 * cos2_sigma_m ** 2) -
+            b / 6. * cos2_sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos2_sigma_m ** 2)))
+        kilometers = minor * a * (sigma - delta_sigma)
+
+    kilometers = np.where(sin_sigma == 0, 0., kilometers)  # Coincident points
+    kilometers = np.where(active, np.nan, kilometers)
+    return kilometers * 1000
+
+
+# geographiclib is imported here: only this (reference) method needs it
+def karney(lat1, lon1, lat2, lon2):
+    from geographiclib.geodesic import Geodesic
+    distances = np.empty(lat1.shape)
+    flat_distances = distances.reshape(-1)
+    for i, (a, b, c, d) in enumerate(zip(lat1.ravel().tolist(), lon1.ravel().tolist(),
+                                         lat2.ravel().tolist(), lon2.ravel().tolist())):
+        flat_distances[i] = Geodesic.WGS84.Inverse(a, b, c, d, Geodesic.DISTANCE)['s12']
+    return distances
+
+
+# Compare speed and error (with respect to KARNEY) of every method on the tracks of the gpx files in directory
+def benchmark(directory, repeat=3):
+    import receiver.reader as reader
+
+    segments = list(reader.gpx_stream(directory))
+    latitudes = np.concatenate([segment.latitude for segment in segments])
+    longitudes = np.concatenate([segment.longitude for segment in segments])
+    # Pairs across two tracks are kept: they add some longer distances to the sample
+    reference = pairwise(latitudes, longitudes, KARNEY)
+
+    print '{} pairs, {} tracks'.format(len(reference), len(segments))
+    print '{:<10} {:>12} {:>14} {:>14} {:>16}'.format('method', 'time (ms)', 'mean err (m)', 'max err (m)',
+                                                     'max rel err (%)')
+    for method in [GPXPY, HAVERSINE, ANDOYER, VINCENTY, KARNEY]:
+        elapsed = min(timeit.repeat(lambda: pairwise(latitudes, longitudes, method), number=1,
+                                    repeat=1 if method == KARNEY else repeat))
+        errors = np.abs(pairwise(latitudes, longitudes, method) - reference)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative_errors = np.where(reference > 0, errors / reference, 0.)
+        print '{:<10} {:>12.2f} {:>14.6f} {:>14.6f} {:>16.6f}'.format(method, elapsed * 1000, np.mean(errors),
+                                                                     np.max(errors), np.max(relative_errors) * 100)
@@ -16,14 +16,41 @@ limitations under the License.
 
 from gpxpy.gpx import GPXTrackSegment
 
+import distance
 import util
+from receiver.reader import ArraySegment
 
 
-def filter_segments_spt(segments, max_dist_error, max_speed_error):
+# Remove points with same timestamp, if they are consecutive (see util.remove_duplicates)
+def remove_segment_duplicates(segment):
+    if isinstance(segment, ArraySegment):
+        return segment.take(util.remove_duplicates_indices(segment.time))
+    return GPXTrackSegment(util.remove_duplicates(segment.points))
+
+
+# vectorized=True uses util.spt_indices instead of the recursive util.spt (same results),
+# with distances computed by distance_method (see distance module).
+# An ArraySegment is filtered without creating point objects, and an ArraySegment is returned.
+# deduplicate=False skips the duplicates removal, for segments already passed to remove_segment_duplicates
+def filter_segment_spt(segment, max_dist_error, max_speed_error, vectorized=False, distance_method=distance.VINCENTY,
+                       deduplicate=True):
+    if vectorized and isinstance(segment, ArraySegment):
+        if deduplicate:
+            segment = remove_segment_duplicates(segment)
+        return segment.take(util.spt_indices(segment.latitude, segment.longitude, segment.time,
+                                             max_dist_error, max_speed_error, distance_method))
+
+    points = util.remove_duplicates(segment.points) if deduplicate else segment.points
+    if vectorized:
+        return GPXTrackSegment(util.spt_vectorized(points, max_dist_error, max_speed_error, distance_method))
+    return GPXTrackSegment(util.spt(points, max_dist_error, max_speed_error))
+
+
+def filter_segments_spt(segments, max_dist_error, max_speed_error, vectorized=False,
+                        distance_method=distance.VINCENTY):
     new_segments = []
     for segment in segments:
-        points = util.remove_duplicates(segment.points)
-        new_segments.append(GPXTrackSegment(util.spt(points, max_dist_error, max_speed_error)))
+        new_segments.append(filter_segment_spt(segment, max_dist_error, max_speed_error, vectorized, distance_method))
     return new_segments
 
 
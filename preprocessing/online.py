@@ -0,0 +1,178 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import calendar
+
+import numpy as np
+from gpxpy.gpx import GPXTrackSegment
+
+import distance
+import util
+
+# Online versions of the preprocessing stages, for live point streams (one object per active track).
+# Each stage consumes points with push(point) and returns what can be emitted so far; flush() is called when the
+# track ends, and returns the rest. Given the same points, outputs are the same of the batch functions (but for the
+# sub-tracks closed early by OnlineSPTFilter, see below).
+
+# Default bound of the OnlineSPTFilter buffer (points): each push costs O(buffer), a sub-track O(buffer ** 2)
+MAX_BUFFER = 1000
+
+
+# Online util.remove_duplicates. Keeps only one pending point
+class OnlineDuplicatesFilter:
+
+    def __init__(self):
+        self.pending = None
+
+    def push(self, point):
+        previous, self.pending = self.pending, point
+        if previous is not None and previous.time_difference(point) > 0:
+            return [previous]
+        return []
+
+    def flush(self):
+        last, self.pending = self.pending, None
+        return [last] if last is not None else []
+
+
+# Online util.spt. Points are kept from the start of the current sub-track (pts[0] of the recursive version)
+# until an error is found: without errors the buffer grows, so max_buffer bounds it (at least 4 points, None for no
+# bound) by closing the sub-track as soon as the buffer is full. The sub-track is then closed as if the check of its
+# last point had failed at its third-last point: its second point is emitted and the next sub-track starts from the
+# third-last point, while the batch spt would go on with the same sub-track. So outputs differ from the batch ones
+# only for tracks with more than max_buffer points without errors, where an extra point is kept at each cut
+class OnlineSPTFilter:
+
+    def __init__(self, max_dist_error, max_speed_error, distance_method=distance.VINCENTY, max_buffer=MAX_BUFFER):
+        self.max_dist_error = max_dist_error
+        self.max_speed_error = max_speed_error
+        self.distance_method = distance_method
+        self.max_buffer = max_buffer
+        self.points = []
+        self.coordinates = []  # (latitude, longitude, seconds) of points
+        self.checked = 2  # rows (e) of the current sub-track already checked without errors
+
+    def push(self, point):
+        self.points.append(point)
+        self.coordinates.append((point.latitude, point.longitude,
+                                 calendar.timegm(point.time.utctimetuple()) + point.time.microsecond / 1e6))
+        emitted = []
+        while len(self.points) - 1 > self.checked:
+            latitudes, longitudes, times = np.array(self.coordinates, dtype=np.float64).T
+            speed_error_idx = util.spt_speed_errors(latitudes, longitudes, times, self.max_speed_error,
+                                                    self.distance_method)
+            s = util.spt_first_error(latitudes, longitudes, times, 0, speed_error_idx, self.max_dist_error,
+                                     self.distance_method, e_from=self.checked + 1)
+            if s is None:
+                self.checked = len(self.points) - 1
+                if self.max_buffer is None or len(self.points) < self.max_buffer:
+                    break
+                s = len(self.points) - 3  # buffer is full: close the sub-track as if the last check failed
+
+            # Same as the recursive step of spt: keep pts[1] and restart from pts[s]
+            emitted.append(self.points[1])
+            self.points = self.points[s:]
+            self.coordinates = self.coordinates[s:]
+            self.checked = 2
+        return emitted
+
+    def flush(self):
+        points, self.points, self.coordinates, self.checked = self.points, [], [], 2
+        if len(points) <= 2:
+            return points
+        return [points[1], points[-1]]
+
+
+# Online splitter.bearing_splitter. Returns the segments (GPXTrackSegment) as soon as they close
+class OnlineBearingSplitter:
+
+    def __init__(self, degree_threshold, min_length, distance_method=distance.GPXPY):
+        self.degree_threshold = degree_threshold
+        self.min_length = min_length
+        self.distance_method = distance_method
+        self.segment = GPXTrackSegment()
+        self.length = 0
+        self.previous_bearing = None
+
+    def _distance(self, point_a, point_b):
+        return float(distance.between(point_b.latitude, point_b.longitude, point_a.latitude, point_a.longitude,
+                                      self.distance_method))
+
+    def _close(self):
+        closed = self.segment if self.length > self.min_length else None
+        self.segment = GPXTrackSegment()
+        self.length = 0
+        self.previous_bearing = None
+        return [closed] if closed is not None else []
+
+    def push(self, point):
+        emitted = []
+        if self.segment.points:
+            last = self.segment.points[-1]
+            current_bearing = util.compass_bearing(last, point)
+            if self.previous_bearing is not None:
+                diff_bearing = abs(self.previous_bearing - current_bearing)
+                if diff_bearing > 180:
+                    diff_bearing = abs(diff_bearing - 360)
+                if diff_bearing > self.degree_threshold:
+                    # The turning point closes the segment and starts the next one
+                    emitted = self._close()
+                    self.segment.points.append(last)
+            self.previous_bearing = current_bearing
+            self.length += self._distance(last, point)
+        self.segment.points.append(point)
+        return emitted
+
+    def flush(self):
+        if not self.segment.points:
+            return []
+        return self._close()
+
+
+# Whole preprocessing of a live track: duplicates removal, SPT and bearing split.
+# push/push_many return the segments closed so far, flush returns the last ones when the track ends
+class OnlineFilter:
+
+    def __init__(self, max_dist_error, max_speed_error, degree_threshold, min_length,
+                 spt_distance=distance.VINCENTY, split_distance=distance.GPXPY, max_buffer=MAX_BUFFER):
+        self.duplicates = OnlineDuplicatesFilter()
+        self.spt = OnlineSPTFilter(max_dist_error, max_speed_error, spt_distance, max_buffer)
+        self.splitter = OnlineBearingSplitter(degree_threshold, min_length, split_distance)
+
+    def _split(self, points):
+        segments = []
+        for point in points:
+            segments += self.splitter.push(point)
+        return segments
+
+    def push(self, point):
+        segments = []
+        for new_point in self.duplicates.push(point):
+            segments += self._split(self.spt.push(new_point))
+        return segments
+
+    def push_many(self, points):
+        segments = []
+        for point in points:
+            segments += self.push(point)
+        return segments
+
+    def flush(self):
+        segments = []
+        for point in self.duplicates.flush():
+            segments += self._split(self.spt.push(point))
+        segments += self._split(self.spt.flush())
+        return segments + self.splitter.flush()
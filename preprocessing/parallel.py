@@ -0,0 +1,38 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import multiprocessing
+
+
+# Apply func to every item using a pool of processes (None means one per core), yielding results
+# in the same order of items as soon as they are ready. With processes=1 items are processed in this process.
+# func must be a module level function, so that it can be sent to the workers.
+def imap_ordered(func, items, processes=1, chunksize=1):
+    if processes == 1:
+        for item in items:
+            yield func(item)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(func, items, chunksize):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
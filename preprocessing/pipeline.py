@@ -0,0 +1,80 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+
+
+# A DAG of named stages. Each stage is a function of the results of its input stages, and it is executed at most
+# once per run: results shared by several stages (e.g. filtered segments, used both by an export and by the
+# splitter) are computed once and passed to all of them.
+class Pipeline:
+
+    def __init__(self):
+        self.stages = {}  # name -> (function, input names)
+        self.order = []  # names, in declaration order
+        self.timings = {}  # name -> seconds spent by the function of the stage in the last run
+
+    # Declare a stage computed by func(*results of inputs). Inputs must be already declared
+    def stage(self, name, func, inputs=()):
+        if name in self.stages:
+            raise ValueError('Stage {} already declared'.format(name))
+        for input_name in inputs:
+            if input_name not in self.stages:
+                raise ValueError('Stage {} depends on unknown stage {}'.format(name, input_name))
+        self.stages[name] = (func, tuple(inputs))
+        self.order.append(name)
+        return self
+
+    # Stages needed by targets, in an order where inputs come before the stages that use them
+    def _plan(self, targets):
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise ValueError('Unknown stage {}'.format(name))
+            if name not in needed:
+                needed.add(name)
+                pending += self.stages[name][1]
+        return [name for name in self.order if name in needed]
+
+    # Run the stages needed by targets (None means all the stages) and return a dict with their results.
+    # Results are released as soon as no other stage needs them, unless they are targets
+    def run(self, targets=None, verbose=True):
+        targets = list(self.order if targets is None else targets)
+        plan = self._plan(targets)
+        remaining_uses = dict((name, 0) for name in plan)
+        for name in plan:
+            for input_name in self.stages[name][1]:
+                remaining_uses[input_name] += 1
+
+        results = {}
+        self.timings = {}
+        for name in plan:
+            func, inputs = self.stages[name]
+            start = time.time()
+            results[name] = func(*[results[input_name] for input_name in inputs])
+            self.timings[name] = time.time() - start
+            if verbose:
+                print 'Stage {}: {:.3f}s'.format(name, self.timings[name])
+            for input_name in inputs:
+                remaining_uses[input_name] -= 1
+                if remaining_uses[input_name] == 0 and input_name not in targets:
+                    del results[input_name]
+
+        if verbose:
+            print 'Pipeline: {} stages, {:.3f}s'.format(len(plan), sum(self.timings.values()))
+        return dict((name, results[name]) for name in targets)
@@ -0,0 +1,96 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import pyproj
+
+WGS84 = 'EPSG:4326'
+ZONE_LETTERS = "CDEFGHJKLMNPQRSTUVWXX"
+
+_transformers = {}  # (source crs, target crs) -> function(xs, ys) -> (xs, ys)
+
+
+# Return a function that projects coordinates arrays (x is longitude/easting) from source_crs to target_crs.
+# Transformers are created once per pair of CRS and then reused
+def transformer(source_crs, target_crs):
+    key = (source_crs, target_crs)
+    if key not in _transformers:
+        if hasattr(pyproj, 'Transformer'):
+            _transformers[key] = pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True).transform
+        else:
+            # pyproj < 2
+            source, target = pyproj.Proj(init=source_crs), pyproj.Proj(init=target_crs)
+            _transformers[key] = lambda xs, ys: pyproj.transform(source, target, xs, ys)
+    return _transformers[key]
+
+
+def transform(source_crs, target_crs, xs, ys):
+    xs, ys = transformer(source_crs, target_crs)(np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64))
+    return np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+
+
+# EPSG code of a WGS84 UTM zone
+def utm_crs(zone_number, northern=True):
+    return 'EPSG:{}'.format((32600 if northern else 32700) + zone_number)
+
+
+# UTM zone numbers of points, with the same exceptions (Norway and Svalbard) of utm.latlon_to_zone_number
+def zone_numbers(latitudes, longitudes):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    numbers = ((longitudes + 180) / 6).astype(np.int64) + 1
+    numbers[(56 <= latitudes) & (latitudes < 64) & (3 <= longitudes) & (longitudes < 12)] = 32
+    svalbard = (72 <= latitudes) & (latitudes <= 84) & (longitudes >= 0)
+    for bound, zone in [(42, 37), (33, 35), (21, 33), (9, 31)]:
+        numbers[svalbard & (longitudes < bound)] = zone
+    return numbers
+
+
+def zone_letters(latitudes):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    idx = np.clip(((latitudes + 80).astype(np.int64)) >> 3, 0, len(ZONE_LETTERS) - 1)
+    letters = np.array(list(ZONE_LETTERS))[idx]
+    letters[(latitudes < -80) | (latitudes > 84)] = ''
+    return letters
+
+
+# Array version of utm.from_latlon. Every point is projected in its own zone (or in zone_number, if given).
+# Returns eastings, northings, zone numbers and zone letters
+def to_utm(latitudes, longitudes, zone_number=None):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if zone_number is None:
+        numbers = zone_numbers(latitudes, longitudes)
+    else:
+        numbers = np.full(latitudes.shape, zone_number, dtype=np.int64)
+    northern = latitudes >= 0
+
+    eastings = np.empty(latitudes.shape)
+    northings = np.empty(latitudes.shape)
+    # One call for each zone (usually just one)
+    for number, is_northern in set(zip(numbers.tolist(), northern.tolist())):
+        mask = (numbers == number) & (northern == is_northern)
+        eastings[mask], northings[mask] = transform(WGS84, utm_crs(number, is_northern),
+                                                    longitudes[mask], latitudes[mask])
+    return eastings, northings, numbers, zone_letters(latitudes)
+
+
+# Array version of utm.to_latlon, for points of the same zone. Returns latitudes and longitudes
+def from_utm(eastings, northings, zone_number, zone_letter=None, northern=None):
+    if northern is None:
+        northern = zone_letter.upper() >= 'N'
+    longitudes, latitudes = transform(utm_crs(zone_number, northern), WGS84, eastings, northings)
+    return latitudes, longitudes
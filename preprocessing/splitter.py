@@ -14,8 +14,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import numpy as np
 from gpxpy.gpx import GPXTrackSegment
+
+import distance
 import util
+from receiver.reader import ArraySegment
 
 
 # Split segment when detect turning point
@@ -52,3 +56,66 @@ def bearing_splitter(points_set, degree_threshold, min_length):
         segments.append(segment)
 
     return segments
+
+
+# Vectorized bearing_splitter. Returns an array of (start, end) index pairs, with end included, one for each segment.
+# Consecutive segments share their bound point, as in bearing_splitter.
+# offsets (optional) are the bounds of different tracks stored in the same arrays (e.g. [0, len track 0, ..., n]):
+# segments never cross tracks.
+# distance_method: method of the distance module used for min_length (GPXPY gives the same results of length_2d)
+def bearing_split_ranges(latitudes, longitudes, degree_threshold, min_length, offsets=None,
+                         distance_method=distance.GPXPY):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    n = len(latitudes)
+    if offsets is None:
+        offsets = [0, n]
+    offsets = np.asarray(offsets, dtype=np.int64)
+    track_starts = offsets[:-1][offsets[:-1] < offsets[1:]]  # skip empty tracks
+    if n == 0 or not len(track_starts):
+        return np.empty((0, 2), dtype=np.int64)
+
+    # Pair j goes from point j to point j + 1. Pairs across two tracks are not valid
+    valid_pairs = np.ones(n - 1, dtype=bool)
+    valid_pairs[track_starts[1:] - 1] = False
+
+    # Cut at point k when bearings of pairs k - 1 and k differ more than degree_threshold
+    diff_bearing = np.abs(np.diff(util.compass_bearings(latitudes, longitudes)))
+    diff_bearing = np.where(diff_bearing > 180, np.abs(diff_bearing - 360), diff_bearing)
+    cuts = np.flatnonzero((diff_bearing > degree_threshold) & valid_pairs[:-1] & valid_pairs[1:]) + 1
+
+    starts = np.union1d(track_starts, cuts)
+    next_starts = np.append(starts[1:], n)
+    # A segment ends at the next cut, or at the last point of its track
+    ends = np.where(np.in1d(next_starts, track_starts) | (next_starts == n), next_starts - 1, next_starts)
+    ranges = np.column_stack((starts, ends))
+
+    # Lengths from the cumulative distance along the arrays (pairs across tracks are never inside a range)
+    cumulative = np.concatenate(([0.], np.cumsum(distance.pairwise(latitudes, longitudes, distance_method))))
+    lengths = cumulative[ends] - cumulative[starts]
+    return ranges[lengths > min_length]
+
+
+# Split an ArraySegment with bearing_split_ranges. Returned segments are views on the arrays of segment
+def bearing_splitter_arrays(segment, degree_threshold, min_length, distance_method=distance.GPXPY):
+    ranges = bearing_split_ranges(segment.latitude, segment.longitude, degree_threshold, min_length,
+                                  distance_method=distance_method)
+    return [segment.slice(start, end + 1) for start, end in ranges.tolist()]
+
+
+def bearing_splitter_vectorized(points_set, degree_threshold, min_length, distance_method=distance.GPXPY):
+    latitudes = np.array([p.latitude for p in points_set], dtype=np.float64)
+    longitudes = np.array([p.longitude for p in points_set], dtype=np.float64)
+    ranges = bearing_split_ranges(latitudes, longitudes, degree_threshold, min_length,
+                                  distance_method=distance_method)
+    return [GPXTrackSegment(points_set[start:end + 1]) for start, end in ranges.tolist()]
+
+
+# vectorized=True uses bearing_split_ranges instead of bearing_splitter (same results).
+# An ArraySegment is split into ArraySegment views
+def split_segment(segment, degree_threshold, min_length, vectorized=False, distance_method=distance.GPXPY):
+    if vectorized and isinstance(segment, ArraySegment):
+        return bearing_splitter_arrays(segment, degree_threshold, min_length, distance_method)
+    if vectorized:
+        return bearing_splitter_vectorized(segment.points, degree_threshold, min_length, distance_method)
+    return bearing_splitter(segment.points, degree_threshold, min_length)
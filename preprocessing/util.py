@@ -16,13 +16,15 @@ limitations under the License.
 
 from __future__ import division
 
+import calendar
 import math
-from functools import partial
-
-import pyproj
+import numpy as np
 from geopy.distance import vincenty
 from shapely.ops import transform
 
+import distance
+import projection
+
 
 # Class that represent a point
 class Point:
@@ -66,6 +68,100 @@ def spt(pts, max_dist_error, max_speed_error):
             return [pts[1], pts[len(pts)-1]]
 
 
+# Iterative, vectorized version of spt. Works on arrays (times in seconds) and returns the indices of kept points
+# distance_method: one of the methods of the distance module (VINCENTY gives the same results of spt)
+def spt_indices(latitudes, longitudes, times, max_dist_error, max_speed_error, distance_method=distance.VINCENTY,
+                block_size=1 << 20):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    n = len(latitudes)
+
+    # Speed errors do not depend on the sub-track under analysis, so they are computed once
+    speed_error_idx = spt_speed_errors(latitudes, longitudes, times, max_speed_error, distance_method)
+
+    kept = []
+    first = 0  # pts[first] is pts[0] of the current recursion step
+    while n - first > 2:
+        s = spt_first_error(latitudes, longitudes, times, first, speed_error_idx, max_dist_error, distance_method,
+                            block_size)
+        if s is None:
+            kept += [first + 1, n - 1]
+            return np.array(kept, dtype=np.int64)
+        kept.append(first + 1)
+        first += s
+    kept += range(first, n)
+    return np.array(kept, dtype=np.int64)
+
+
+# Indices of the points whose speed changes more than max_speed_error (between previous and next point)
+def spt_speed_errors(latitudes, longitudes, times, max_speed_error, distance_method=distance.VINCENTY):
+    n = len(latitudes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        velocities = rounded_distances(latitudes[1:], longitudes[1:], latitudes[:-1], longitudes[:-1],
+                                       distance_method) / np.abs(times[1:] - times[:-1])
+        speed_errors = np.zeros(n, dtype=bool)
+        speed_errors[1:n - 1] = np.abs(velocities[1:] - velocities[:-1]) > max_speed_error
+    return np.flatnonzero(speed_errors)
+
+
+# Find the first (e, s) pair, in the order used by spt, that breaks the error bounds for the sub-track
+# starting at index first. Returns s (relative to first), or None if there is no error.
+# Rows before e_from (relative to first) are known to have no errors, and they are skipped
+def spt_first_error(latitudes, longitudes, times, first, speed_error_idx, max_dist_error,
+                    distance_method=distance.VINCENTY, block_size=1 << 20, e_from=3):
+    n = len(latitudes) - first
+
+    # First speed error after the start point: every e > s_speed + 1 reports an error, at s_speed at the latest
+    pos = np.searchsorted(speed_error_idx, first + 1)
+    s_speed = speed_error_idx[pos] - first if pos < len(speed_error_idx) else None
+    last_e = n - 1 if s_speed is None else min(n - 1, s_speed + 2)
+
+    lat0, lon0, t0 = latitudes[first], longitudes[first], times[first]
+    e_start = max(3, e_from)
+    rows = 32
+    while e_start <= last_e:
+        e_end = min(last_e + 1, e_start + rows)
+        e = np.arange(e_start, e_end)[:, np.newaxis]
+        s = np.arange(1, e_end - 2)[np.newaxis, :]
+        valid = s < e - 1
+
+        lat_s, lon_s, t_s = latitudes[first + s], longitudes[first + s], times[first + s]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.abs(t_s - t0) / np.abs(times[first + e] - t0)
+        new_lat = lat_s + (latitudes[first + e] - lat0) * ratio
+        new_lon = lon_s + (longitudes[first + e] - lon0) * ratio
+        lat_s, lon_s = np.broadcast_arrays(lat_s, lon_s, new_lat)[:2]
+
+        errors = np.zeros(valid.shape, dtype=bool)
+        # Exact (and expensive) distances only where the fast approximation is not clearly below the threshold
+        candidates = valid & (distance.equirectangular(lat_s, lon_s, new_lat, new_lon) > max_dist_error * .99 - 1)
+        if np.any(candidates):
+            errors[candidates] = rounded_distances(lat_s[candidates], lon_s[candidates], new_lat[candidates],
+                                                   new_lon[candidates], distance_method) > max_dist_error
+        if s_speed is not None and s_speed < e_end - 2:
+            errors[:, s_speed - 1] |= valid[:, s_speed - 1]
+
+        error_rows = np.flatnonzero(errors.any(axis=1))
+        if len(error_rows):
+            return int(np.argmax(errors[error_rows[0]])) + 1
+
+        e_start = e_end
+        rows = max(1, min(rows * 2, block_size // max(1, e_end)))
+    return None
+
+
+def spt_vectorized(pts, max_dist_error, max_speed_error, distance_method=distance.VINCENTY):
+    if len(pts) <= 2:
+        return pts
+    latitudes = np.array([p.latitude for p in pts], dtype=np.float64)
+    longitudes = np.array([p.longitude for p in pts], dtype=np.float64)
+    times = np.array([calendar.timegm(p.time.utctimetuple()) + p.time.microsecond / 1e6 for p in pts],
+                     dtype=np.float64)
+    return [pts[i] for i in spt_indices(latitudes, longitudes, times, max_dist_error, max_speed_error,
+                                        distance_method)]
+
+
 def compass_bearing(point_a, point_b):
 
     lat1 = math.radians(point_a.latitude)
@@ -87,12 +183,23 @@ def compass_bearing(point_a, point_b):
     return cmp_bearing
 
 
+# Vectorized compass_bearing between consecutive points
+def compass_bearings(latitudes, longitudes):
+    lat1 = np.radians(latitudes[:-1])
+    lat2 = np.radians(latitudes[1:])
+
+    diff_long = np.radians(longitudes[1:] - longitudes[:-1])
+
+    x = np.sin(diff_long) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - (np.sin(lat1) * np.cos(lat2) * np.cos(diff_long))
+
+    initial_bearing = np.degrees(np.arctan2(x, y))
+    return (initial_bearing + 360) % 360
+
+
 def line_length_meters(line_string):
-    # Projection
-    project = partial(
-        pyproj.transform,
-        pyproj.Proj(init='EPSG:4326'),
-        pyproj.Proj(init='EPSG:32633'))  # 3857
+    # Projection (the transformer is cached, and it projects all the coordinates of the line in one call)
+    project = projection.transformer(projection.WGS84, 'EPSG:32633')  # 3857
 
     projected_line = transform(project, line_string)
 
@@ -107,6 +214,19 @@ def distance_between_points(point_a, point_b):
     return round(vincenty(a, b).kilometers * 1000)
 
 
+# Vectorized distance_between_points (rounded to meters), with the given distance method
+def rounded_distances(lat1, lon1, lat2, lon2, method=distance.VINCENTY):
+    return np.floor(distance.between(lat1, lon1, lat2, lon2, method) + .5)
+
+
+# Indices of points kept by remove_duplicates
+def remove_duplicates_indices(times):
+    times = np.asarray(times, dtype=np.float64)
+    keep = np.ones(len(times), dtype=bool)
+    keep[:-1] = np.abs(times[1:] - times[:-1]) > 0
+    return np.flatnonzero(keep)
+
+
 # Discard point if next point has same timestamp
 def remove_duplicates(points_set):
     return_set = []
@@ -14,30 +14,193 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import calendar
+import datetime
 import glob
+from functools import partial
+import xml.etree.cElementTree as ElementTree
 
 import gpxpy.gpx
 import numpy as np
+from gpxpy.gpxfield import parse_time
 
+from preprocessing import distance
+from preprocessing import parallel
 
-# Read all files locate in directory and return an array of all segments
-def gpx_reader(directory):
-    segments = []
+
+# Track segment stored as parallel arrays (one item per point) instead of GPXTrackPoint objects
+class ArraySegment(object):
+    def __init__(self, latitude, longitude, elevation, time, track_name=None, filename=None,
+                 track_index=0, segment_index=0):
+        self.latitude = latitude  # degrees, float64
+        self.longitude = longitude  # degrees, float64
+        self.elevation = elevation  # meters, float64 (nan if missing)
+        self.time = time  # seconds since epoch (UTC), float64 (nan if missing)
+        self.track_name = track_name
+        self.filename = filename
+        self.track_index = track_index
+        self.segment_index = segment_index
+
+    def __len__(self):
+        return len(self.latitude)
+
+    # GPXTrackPoint view of the segment, for functions that still work point by point
+    @property
+    def points(self):
+        points = []
+        for lat, lon, ele, t in zip(self.latitude.tolist(), self.longitude.tolist(),
+                                    self.elevation.tolist(), self.time.tolist()):
+            points.append(gpxpy.gpx.GPXTrackPoint(lat, lon,
+                                                  elevation=None if ele != ele else ele,
+                                                  time=None if t != t else datetime.datetime.utcfromtimestamp(t)))
+        return points
+
+    # New segment with only the points at indices (same metadata)
+    def take(self, indices):
+        return ArraySegment(self.latitude[indices], self.longitude[indices], self.elevation[indices],
+                            self.time[indices], self.track_name, self.filename, self.track_index, self.segment_index)
+
+    # New segment made of views on the points from start to end (excluded)
+    def slice(self, start, end):
+        return ArraySegment(self.latitude[start:end], self.longitude[start:end], self.elevation[start:end],
+                            self.time[start:end], self.track_name, self.filename, self.track_index,
+                            self.segment_index)
+
+    # With the default distance method the length is the same computed by gpxpy
+    def length_2d(self, distance_method=distance.GPXPY):
+        return float(np.sum(distance.pairwise(self.latitude, self.longitude, distance_method)))
+
+    @staticmethod
+    def from_points(points, track_name=None, filename=None, track_index=0, segment_index=0):
+        latitude = np.array([p.latitude for p in points], dtype=np.float64)
+        longitude = np.array([p.longitude for p in points], dtype=np.float64)
+        elevation = np.array([np.nan if p.elevation is None else p.elevation for p in points], dtype=np.float64)
+        time = np.array([np.nan if p.time is None else calendar.timegm(p.time.utctimetuple()) +
+                         p.time.microsecond / 1e6 for p in points], dtype=np.float64)
+        return ArraySegment(latitude, longitude, elevation, time, track_name, filename, track_index, segment_index)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+# Convert GPX timestamps to seconds since epoch. Missing timestamps become nan
+def _epoch_seconds(times):
+    epoch = np.full(len(times), np.nan)
+    fast = [i for i, t in enumerate(times) if t is not None and len(t) == 20 and t[19] == 'Z']
+    if fast:
+        stamps = np.array([times[i][:19] for i in fast], dtype='datetime64[s]')
+        epoch[fast] = stamps.astype(np.int64)
+    for i, t in enumerate(times):
+        # Fractional seconds and time zone offsets are left to gpxpy
+        if t is not None and not (len(t) == 20 and t[19] == 'Z'):
+            parsed = parse_time(t)
+            offset = parsed.utcoffset() if parsed.tzinfo is not None else None
+            seconds = calendar.timegm(parsed.timetuple()) + parsed.microsecond / 1e6
+            epoch[i] = seconds - (offset.total_seconds() if offset is not None else 0)
+    return epoch
+
+
+# Parse a single gpx file incrementally, yielding (track index, ArraySegment) for each track segment and
+# (track index, None) at the end of each track (also of tracks without segments)
+def _gpx_file_items(filename):
+    track_name = None
+    track_index = -1
+    segment_index = -1
+    latitude, longitude, elevation, times = [], [], [], []
+    ele, time = None, None
+    path = []
+
+    for event, elem in ElementTree.iterparse(filename, events=('start', 'end')):
+        tag = _local_name(elem.tag)
+        if event == 'start':
+            path.append(tag)
+            if tag == 'trk':
+                track_name = None
+                track_index += 1
+                segment_index = -1
+            elif tag == 'trkseg':
+                segment_index += 1
+                latitude, longitude, elevation, times = [], [], [], []
+            elif tag == 'trkpt':
+                ele, time = None, None
+            continue
+
+        path.pop()
+        if tag == 'ele' and path and path[-1] == 'trkpt':
+            ele = elem.text
+        elif tag == 'time' and path and path[-1] == 'trkpt':
+            time = elem.text.strip() if elem.text else None
+        elif tag == 'name' and path and path[-1] == 'trk':
+            track_name = elem.text
+        elif tag == 'trkpt':
+            latitude.append(float(elem.get('lat')))
+            longitude.append(float(elem.get('lon')))
+            elevation.append(float(ele) if ele else np.nan)
+            times.append(time)
+            elem.clear()
+        elif tag == 'trkseg':
+            elem.clear()
+            yield track_index, ArraySegment(np.array(latitude, dtype=np.float64),
+                                            np.array(longitude, dtype=np.float64),
+                                            np.array(elevation, dtype=np.float64),
+                                            _epoch_seconds(times),
+                                            track_name, filename, track_index, segment_index)
+        elif tag == 'trk':
+            elem.clear()
+            yield track_index, None
+
+
+# Parse a single gpx file incrementally, yielding one ArraySegment per track segment
+def gpx_file_stream(filename):
+    for _, segment in _gpx_file_items(filename):
+        if segment is not None:
+            yield segment
+
+
+# Read all files located in directory, yielding segments one at a time as ArraySegment
+def gpx_stream(directory):
     for filename in glob.glob(directory + "*.gpx"):
-        gpx = gpxpy.parse(open(filename, 'r'))
+        for segment in gpx_file_stream(filename):
+            yield segment
+
 
-        for gpx_track in gpx.tracks:
-            for segment in gpx_track.segments:
-                segments.append(segment)
+def _read_file_segments(filename):
+    gpx = gpxpy.parse(open(filename, 'r'))
+    segments = []
+    for gpx_track in gpx.tracks:
+        for segment in gpx_track.segments:
+            segments.append(segment)
     return segments
 
 
-def gpx_length_stats(directory):
+# Length (km) of each track of the file, as gpx_track.length_2d() / 1000 (0 for tracks without points)
+def _file_tracks_length_km(filename, distance_method=distance.GPXPY):
     length_km = []
-    for filename in glob.glob(directory + "*.gpx"):
-        gpx = gpxpy.parse(open(filename, 'r'))
-        for gpx_track in gpx.tracks:
-            length_km.append(gpx_track.length_2d() / 1000.0)
+    track_length = 0.
+    for _, segment in _gpx_file_items(filename):
+        if segment is None:
+            length_km.append(track_length)
+            track_length = 0.
+        else:
+            track_length += segment.length_2d(distance_method) / 1000.0
+    return length_km
+
+
+# Read all files locate in directory and return an array of all segments.
+# Files are parsed by a pool of processes (see parallel.imap_ordered), segments keep the order of files
+def gpx_reader(directory, processes=1):
+    segments = []
+    for file_segments in parallel.imap_ordered(_read_file_segments, glob.glob(directory + "*.gpx"), processes):
+        segments += file_segments
+    return segments
+
+
+def gpx_length_stats(directory, processes=1, distance_method=distance.GPXPY):
+    length_km = []
+    for file_length_km in parallel.imap_ordered(partial(_file_tracks_length_km, distance_method=distance_method),
+                                                glob.glob(directory + "*.gpx"), processes):
+        length_km += file_length_km
 
     print np.mean(length_km)
     print np.max(length_km)
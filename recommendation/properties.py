@@ -0,0 +1,80 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+from model import model
+
+
+# Property vectors of the segments (columns in vocabulary order), as rows of one matrix indexed by segment id.
+# Temporary segments (pieces of a segment, see model.Segment.origin_id) use the row of their segment
+class PropertyMatrix:
+
+    def __init__(self, vocabulary=model.LABELS):
+        self.vocabulary = vocabulary
+        self.rows = {}  # segment id -> row of matrix
+        self.matrix = np.zeros((0, len(vocabulary)))
+
+    def _append(self, ids, vectors):
+        if not ids:
+            return self
+        first = len(self.rows)
+        for i, segment_id in enumerate(ids):
+            self.rows[segment_id] = first + i
+        vectors = np.array([list(vector) + [0] * (len(self.vocabulary) - len(vector)) for vector in vectors],
+                           dtype=np.float64)
+        self.matrix = np.concatenate([self.matrix, vectors])
+        return self
+
+    # Add the segments of segment_py (all of them, or the ones in ids) not added yet. Stored properties are read in
+    # one query, labels (in another query) only for segments without them
+    def load(self, session, ids=None):
+        query = session.query(model.Segment.id, model.Segment.properties).order_by(model.Segment.id)
+        if ids is not None:
+            query = query.filter(model.Segment.id.in_(list(ids)))
+        rows = [(segment_id, properties) for segment_id, properties in query if segment_id not in self.rows]
+
+        labels = {}
+        without_properties = [segment_id for segment_id, properties in rows if properties is None]
+        if without_properties:
+            query = session.query(model.Label.segment_id, model.Label.label, model.Label.label_rate) \
+                .filter(model.Label.segment_id.in_(without_properties)).order_by(model.Label.id)
+            for segment_id, label, label_rate in query:
+                labels.setdefault(segment_id, []).append((label, label_rate))
+        vectors = [properties if properties is not None else self.vocabulary.vector(labels.get(segment_id, ()))
+                   for segment_id, properties in rows]
+        return self._append([segment_id for segment_id, _ in rows], vectors)
+
+    # Add segments already in memory (with properties or labels loaded)
+    def add(self, segments):
+        segments = [segment for segment in segments if segment.id not in self.rows]
+        return self._append([segment.id for segment in segments],
+                            [segment.get_properties_vector() for segment in segments])
+
+    @staticmethod
+    def _segment_id(segment):
+        return segment.id if segment.id is not None else segment.origin_id
+
+    # Rows of the segments (matrix[rows] are their property vectors). Segments not added yet are loaded with session
+    def rows_of(self, segments, session=None):
+        ids = [self._segment_id(segment) for segment in segments]
+        missing = set(ids).difference(self.rows)
+        if missing and session is not None:
+            self.load(session, missing)
+        return np.array([self.rows[segment_id] for segment_id in ids], dtype=np.int64)
+
+    def vectors(self, segments, session=None):
+        return self.matrix[self.rows_of(segments, session)]
@@ -0,0 +1,176 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+
+import numpy as np
+from scipy import sparse
+
+# Allowed methods (same of Recommender)
+GLOCAL = 'glocal'
+GLOBAL = 'global'
+LOCAL = 'local'
+
+
+# Users scored together by PathScorer.user_scores are limited to keep segments x users x labels under BLOCK_SIZE
+BLOCK_SIZE = 1 << 22
+
+
+# 1 - scipy.spatial.distance.cosine(vector, profile) along the last axis of vectors and profiles (broadcast, e.g.
+# (n x 1 x labels) vectors with (users x labels) profiles give (n x users) similarities). nan for zero vectors
+def cosine_similarities(vectors, profiles):
+    vectors = np.asarray(vectors, dtype=np.float64)
+    profiles = np.asarray(profiles, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        uv = np.mean(vectors * profiles, axis=-1)
+        uu = np.mean(np.square(vectors), axis=-1)
+        vv = np.mean(np.square(profiles), axis=-1)
+        return 1 - (1.0 - uv / np.sqrt(uu * vv))
+
+
+# Scores of Recommender.recommend for all the candidate paths ([([segments], length)]) at once.
+# Segments of all the paths are the columns of a sparse path x segment incidence matrix, whose values are the weights
+# of the segments in their path: 1, or length on path length times the decay exp(-partial length / path length).
+# Path vectors are the products of the incidence matrix with the property vectors
+class PathScorer:
+
+    def __init__(self, paths, property_matrix, session=None):
+        self.path_lengths = np.array([path[1] for path in paths], dtype=np.float64)
+        counts = np.array([len(path[0]) for path in paths], dtype=np.int64)
+        segments = [segment for path in paths for segment in path[0]]
+        self.vectors = property_matrix.vectors(segments, session) if segments \
+            else np.zeros((0, len(property_matrix.vocabulary)))
+        self.counts = counts
+
+        # Lengths in a (paths x longest path) array: partial lengths are the sums along the rows
+        width = counts.max() if len(counts) else 0
+        mask = np.arange(width) < counts[:, np.newaxis]
+        lengths = np.zeros(mask.shape)
+        lengths[mask] = [segment.length for segment in segments]
+        partial_lengths = np.cumsum(lengths, axis=1)
+        path_lengths = self.path_lengths[:, np.newaxis]
+        self.length_weights = (lengths / path_lengths)[mask]
+        self.decays = np.exp(-(partial_lengths / path_lengths))[mask]
+
+        self.path_index = np.repeat(np.arange(len(paths)), counts)
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        self.incidence = sparse.csr_matrix((np.ones(len(segments)), np.arange(len(segments)), indptr),
+                                           shape=(len(paths), len(segments)))
+
+    # Incidence matrix with the given segment weights
+    def _weighted(self, weights):
+        incidence = self.incidence.copy()
+        incidence.data = np.asarray(weights, dtype=np.float64)
+        return incidence
+
+    # Sums of the values (segments x users) of each path where valid (segments). Paths with the same number of
+    # values are summed together as rows of a matrix, so that each sum is the same (pairwise summation) of np.sum
+    # over the list of values of the path
+    def _path_sums(self, values, valid):
+        path_index = self.path_index[valid]
+        values = values[valid]
+        counts = np.bincount(path_index, minlength=len(self.counts))
+        positions = np.arange(len(values)) - np.repeat(np.cumsum(counts) - counts, counts)
+        row_of_path = np.zeros(len(self.counts), dtype=np.int64)
+        sums = np.zeros((len(self.counts), values.shape[1]))
+        for count in np.unique(counts[counts > 0]):
+            paths = np.nonzero(counts == count)[0]
+            row_of_path[paths] = np.arange(len(paths))
+            selected = counts[path_index] == count
+            rows = np.zeros((len(paths), values.shape[1], count))
+            rows[row_of_path[path_index[selected]], :, positions[selected]] = values[selected]
+            sums[paths] = np.sum(rows, axis=-1)
+        return sums
+
+    # Segment weights on their paths, times the segment-user similarities (segments x users) if given (nan
+    # similarities are skipped, weight 0). As in Recommender, baseline uses the plain weights (1) with glocal (any
+    # method but local and global) and the length and decay weights with local and global
+    def _weights(self, method, baseline, similarities=None):
+        plain = (method not in [LOCAL, GLOBAL]) == baseline
+        if similarities is None:
+            return np.ones(len(self.decays)) if plain else self.length_weights * self.decays
+        if plain:
+            weights = similarities
+        else:
+            weights = self.length_weights[:, np.newaxis] * similarities * self.decays[:, np.newaxis]
+        return np.where(np.isnan(similarities), 0., weights)
+
+    def _segment_similarities(self, profiles):
+        return cosine_similarities(self.vectors[:, np.newaxis, :], profiles)
+
+    # Path vectors (paths x users x labels, paths x 1 x labels for global: they do not depend on users)
+    def path_vectors(self, method, profiles, baseline=False):
+        if method in [LOCAL, GLOBAL]:
+            return self._weighted(self._weights(method, baseline)).dot(self.vectors)[:, np.newaxis, :]
+        weights = self._weights(method, baseline, self._segment_similarities(profiles))
+        contributions = weights[:, :, np.newaxis] * self.vectors[:, np.newaxis, :]
+        return self.incidence.dot(contributions.reshape(len(contributions), -1)) \
+            .reshape(len(self.counts), len(profiles), -1)
+
+    # Path-user similarities (paths x users), before the length factor of Recommender.recommend
+    def similarities(self, method, profiles, baseline=False):
+        if method == LOCAL:
+            similarities = self._segment_similarities(profiles)
+            weights = self._weights(method, baseline, similarities)
+            valid = ~np.all(np.isnan(similarities), axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return self._path_sums(weights, valid) / self.counts[:, np.newaxis]
+        return cosine_similarities(self.path_vectors(method, profiles, baseline), profiles)
+
+    # Scores of Recommender.recommend (similarity times path length on exact_len) for each user (profiles are the
+    # rows of a users x labels matrix): users x paths
+    def user_scores(self, method, profiles, exact_len, baseline=False):
+        profiles = np.asarray(profiles, dtype=np.float64).reshape(-1, self.vectors.shape[1])
+        block = max(1, BLOCK_SIZE // max(1, self.vectors.size))
+        scores = np.empty((len(profiles), len(self.counts)))
+        for first in range(0, len(profiles), block):
+            similarities = self.similarities(method, profiles[first:first + block], baseline)
+            scores[first:first + block] = (similarities * (self.path_lengths / float(exact_len))[:, np.newaxis]).T
+        return scores
+
+    # Scores of a single user
+    def scores(self, method, profile, exact_len, baseline=False):
+        return self.user_scores(method, [profile], exact_len, baseline)[0]
+
+
+# Time the scoring of the paths (candidate paths of recommender if None) with PathScorer and with the segment by
+# segment functions of recommender (Recommender.path_similarity), for all the methods, with and without baseline.
+# Returns {(method, baseline): (loop seconds, matrix seconds, same ranking)}
+def benchmark(recommender, paths=None, repeat=3, verbose=True):
+    if paths is None:
+        paths = recommender.get_candidate_paths()
+    profile = recommender.user.get_profile()
+    results = {}
+    for method in [GLOCAL, LOCAL, GLOBAL]:
+        for baseline in [False, True]:
+            loop_time = matrix_time = float('inf')
+            for _ in range(repeat):
+                start = time.time()
+                loop_scores = [recommender.path_similarity(path, method, baseline) for path in paths]
+                loop_time = min(loop_time, time.time() - start)
+
+                start = time.time()
+                scorer = PathScorer(paths, recommender.property_matrix, recommender.session)
+                matrix_scores = scorer.scores(method, profile, recommender.exact_len, baseline)
+                matrix_time = min(matrix_time, time.time() - start)
+
+            ranking = sorted(range(len(paths)), key=lambda i: loop_scores[i], reverse=True)
+            same = ranking == sorted(range(len(paths)), key=lambda i: matrix_scores[i], reverse=True)
+            results[(method, baseline)] = (loop_time, matrix_time, same)
+            if verbose:
+                print '{} baseline={}: {} paths, loop {:.3f}s, matrix {:.3f}s ({:.1f}x), same ranking: {}'.format(
+                    method, baseline, len(paths), loop_time, matrix_time, loop_time / max(matrix_time, 1e-9), same)
+    return results
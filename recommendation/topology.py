@@ -0,0 +1,133 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from geoalchemy2.shape import to_shape
+from shapely import wkb
+from sqlalchemy import text
+
+from model import model
+from recommendation import engine
+
+# ST_DWithin on geography(geom) (spheroid) only pre-selects the start segments with the geography index of segment_py
+# (see bulk.BulkLoader), the threshold is checked on the sphere (ST_Distance_Sphere, as in
+# Recommender._find_nearest_lines): the margin keeps segments near the threshold
+DWITHIN_MARGIN = 1.01
+
+# Path search of Recommender.get_candidate_paths, in a single query.
+# Start segments (within threshold meters from the point) are split at their point nearest to the user, and each
+# half is walked from its far end (the end opposite to the split point). Expansion stops when the length is over
+# exact_len (the last segment is truncated afterwards) or at dead ends (nodes with only one segment). As in
+# _find_subpaths, a segment already in the path names is never used again (this also stops cycles), and the
+# names of the neighbors visited before at the same node (smaller ids) are added to the names of the following ones.
+# Rows are the leaves of the search: ordering by the ids arrays gives the depth-first order of the recursion
+CANDIDATE_PATHS = text('''
+WITH RECURSIVE
+start_segments AS (
+    SELECT s.id AS segment_id, s.name, s.start_node, s.end_node, start_nodes.degree AS start_degree,
+           end_nodes.degree AS end_degree, s.geom,
+           ST_Distance_Sphere(s.geom, ST_GeomFromText(:point)) AS distance,
+           ST_LineLocatePoint(s.geom, ST_ClosestPoint(s.geom, ST_GeomFromText(:point))) AS located
+    FROM segment_py s
+    JOIN segment_node_py start_nodes ON start_nodes.id = s.start_node
+    JOIN segment_node_py end_nodes ON end_nodes.id = s.end_node
+    WHERE ST_DWithin(geography(s.geom), ST_GeogFromText(:point), :threshold * :margin)),
+halves AS (
+    SELECT row_number() OVER (ORDER BY distance, segment_id, half) AS rank, *
+    FROM (SELECT segment_id, name, 0 AS half, start_node AS far_node, start_degree AS far_degree,
+                 FALSE AS from_start, ST_LineSubstring(geom, 0, located) AS half_geom, distance
+          FROM start_segments WHERE located > 0 AND distance <= :threshold
+          UNION ALL
+          SELECT segment_id, name, 1, end_node, end_degree, TRUE, ST_LineSubstring(geom, located, 1), distance
+          FROM start_segments WHERE located < 1 AND distance <= :threshold) AS pieces),
+paths AS (
+    SELECT rank, ARRAY[segment_id] AS ids, ARRAY[name]::varchar[] AS names, far_node AS node, far_degree AS degree,
+           ST_Length(half_geom::geography) AS length, from_start
+    FROM halves
+    UNION ALL
+    SELECT p.rank, p.ids || t.id,
+           p.names || ARRAY(SELECT sibling.name FROM segment_py sibling
+                            WHERE (sibling.start_node = p.node OR sibling.end_node = p.node)
+                              AND sibling.id < t.id AND NOT sibling.name = ANY(p.names)
+                            ORDER BY sibling.id)::varchar[] || t.name::varchar,
+           far.id, far.degree, p.length + t.length, t.start_node <> far.id
+    FROM paths p
+    JOIN segment_py t ON t.start_node = p.node OR t.end_node = p.node
+    JOIN segment_node_py far ON far.id = CASE WHEN t.start_node <> p.node THEN t.start_node ELSE t.end_node END
+    WHERE p.length <= :exact_len AND p.degree > 1 AND NOT t.name = ANY(p.names)
+      AND NOT EXISTS (SELECT 1 FROM segment_py earlier
+                      WHERE (earlier.start_node = p.node OR earlier.end_node = p.node)
+                        AND earlier.id < t.id AND earlier.name = t.name))
+SELECT p.rank, p.ids, p.length, p.from_start, ST_AsBinary(h.half_geom) AS start_wkb
+FROM paths p JOIN halves h ON h.rank = p.rank
+WHERE p.length > :exact_len OR p.degree = 1
+ORDER BY p.rank, p.ids
+''')
+
+
+# Leaves of the path search as rows (rank of the start half, segment ids, length, from_start, WKB of the start
+# half). from_start tells if the last segment is walked from its start point. Lengths are not truncated
+def candidate_path_rows(session, longitude, latitude, start_threshold, exact_len):
+    point = 'POINT({} {})'.format(longitude, latitude)
+    parameters = dict(point=point, threshold=start_threshold, margin=DWITHIN_MARGIN, exact_len=exact_len)
+    return session.execute(CANDIDATE_PATHS, parameters).fetchall()
+
+
+# Segments by id, with the shape attribute as in engine.SegmentGraph
+def _load_segments(session, ids):
+    if not ids:
+        return {}
+    query = session.query(model.Segment).filter(model.Segment.id.in_(ids))
+    segments = {}
+    for segment in query:
+        segment.shape = to_shape(segment.geom)
+        segments[segment.id] = segment
+    return segments
+
+
+# Same results of Recommender.get_candidate_paths ([([segments], length)]), with the search done by the database.
+# Here: skip of the start halves already found in previous paths, truncation of the last segments and min_len
+def candidate_paths(session, longitude, latitude, start_threshold, min_len, exact_len):
+    rows = candidate_path_rows(session, longitude, latitude, start_threshold, exact_len)
+    segments = _load_segments(session, set(i for row in rows for i in row.ids))
+
+    all_paths = []
+    found_names = set()  # names of the segments of the paths found, without the first ones
+    counted = 0
+    start_piece, start_rank, skip = None, None, False
+    for row in rows:
+        if row.rank != start_rank:
+            start_rank = row.rank
+            start_segment = segments[row.ids[0]]
+            found_names.update(segment.name for path_tuple in all_paths[counted:] for segment in path_tuple[0][1:])
+            counted = len(all_paths)
+            skip = start_segment.name in found_names
+            if not skip:
+                start_shape = wkb.loads(bytes(row.start_wkb))
+                start_length = row.length - sum(segments[i].length for i in row.ids[1:])
+                start_piece = engine.segment_piece(start_segment, start_shape, start_length)
+        if skip:
+            continue
+
+        path = [start_piece] + [segments[i] for i in row.ids[1:]]
+        length = row.length
+        if length > exact_len:
+            last = path[-1]
+            truncate_point = float(exact_len - (length - last.length)) / float(last.length)
+            path[-1] = engine.segment_piece(last, engine.truncate_line(last.shape, truncate_point, row.from_start))
+            length = exact_len
+        all_paths.append((path, length))
+
+    return [path_tuple for path_tuple in all_paths if path_tuple[1] > min_len]
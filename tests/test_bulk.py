@@ -0,0 +1,113 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+
+from shapely.geometry import LineString
+from sqlalchemy import create_engine
+
+from model import bulk
+from model import model
+from tests import fixtures
+
+# Segments of an older release (the columns of postgis_dump): three segments meeting at their ends
+OLD_SCHEMA = ['CREATE TABLE segment_py (id serial PRIMARY KEY, name varchar, geom geometry)',
+              'CREATE TABLE segment_label_py (id serial PRIMARY KEY, label varchar, label_rate float8, '
+              'segment_id integer REFERENCES segment_py (id))',
+              "INSERT INTO segment_py (name, geom) VALUES "
+              "('a', ST_GeomFromText('LINESTRING(9.40 45.80, 9.41 45.80)')), "
+              "('b', ST_GeomFromText('LINESTRING(9.41 45.80, 9.41 45.81)')), "
+              "('c', ST_GeomFromText('LINESTRING(9.41 45.80, 9.42 45.79)'))",
+              "INSERT INTO segment_label_py (label, label_rate, segment_id) VALUES ('rock', 0.5, 1), ('dirt', 1, 2)"]
+
+
+def drop_tables(engine):
+    for table in [model.Label.__table__, model.Segment.__table__, model.SegmentNode.__table__,
+                  model.IngestedFile.__table__]:
+        if table.exists(engine):
+            table.drop(engine)
+
+
+class TestCheckSchema(unittest.TestCase):
+
+    # information_schema.columns of an sqlite database, with the given columns
+    def _engine(self, columns):
+        engine = create_engine('sqlite://')
+        connection = engine.connect()
+        connection.execute("ATTACH DATABASE ':memory:' AS information_schema")
+        connection.execute('CREATE TABLE information_schema.columns (table_name varchar, column_name varchar)')
+        for table_name, column_name in columns:
+            connection.execute('INSERT INTO information_schema.columns VALUES (?, ?)', (table_name, column_name))
+        return connection
+
+    def test_old_segments_are_rejected(self):
+        connection = self._engine([('segment_py', 'id'), ('segment_py', 'name'), ('segment_py', 'geom')])
+        self.assertEqual(bulk.missing_columns(connection),
+                         ['segment_py.source', 'segment_py.length', 'segment_py.start_node', 'segment_py.end_node',
+                          'segment_py.properties', 'segment_node_py.key'])
+        self.assertRaises(RuntimeError, bulk.check_schema, connection)
+
+    def test_current_segments_are_accepted(self):
+        columns = [(model.Segment.__tablename__, column.name) for column in model.Segment.__table__.columns] + \
+                  [(model.SegmentNode.__tablename__, column.name) for column in model.SegmentNode.__table__.columns]
+        bulk.check_schema(self._engine(columns))
+
+
+@unittest.skipUnless(fixtures.TEST_DATABASE, 'needs a PostGIS database (HIKING_TEST_DATABASE)')
+class TestUpgradeSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = fixtures.database_engine()
+        drop_tables(self.engine)
+        for statement in OLD_SCHEMA:
+            self.engine.execute(statement)
+
+    def tearDown(self):
+        drop_tables(self.engine)
+
+    def test_upgrade_keeps_segments_and_labels(self):
+        self.assertRaises(RuntimeError, bulk.check_schema, self.engine)
+        bulk.upgrade_schema(self.engine)
+        bulk.check_schema(self.engine)
+
+        rows = self.engine.execute('SELECT s.name, s.length, s.properties, s.start_node, s.end_node, '
+                                   'sn.degree, en.degree FROM segment_py s '
+                                   'JOIN segment_node_py sn ON sn.id = s.start_node '
+                                   'JOIN segment_node_py en ON en.id = s.end_node ORDER BY s.id').fetchall()
+        self.assertEqual([row[0] for row in rows], ['a', 'b', 'c'])
+        self.assertTrue(all(row[1] > 0 for row in rows))
+        self.assertEqual(rows[0][2], model.LABELS.vector([('rock', 0.5)]))
+        self.assertEqual(rows[1][2], model.LABELS.vector([('dirt', 1.0)]))
+        # The three segments meet at the end of a, the start of b and c
+        self.assertEqual(rows[0][4], rows[1][3])
+        self.assertEqual(rows[0][4], rows[2][3])
+        self.assertEqual([(row[5], row[6]) for row in rows], [(1, 3), (3, 1), (3, 1)])
+        self.assertEqual(self.engine.execute('SELECT count(*) FROM segment_label_py').scalar(), 2)
+
+    def test_new_segments_reuse_nodes(self):
+        bulk.upgrade_schema(self.engine)
+        nodes = self.engine.execute('SELECT id, degree FROM segment_node_py ORDER BY id').fetchall()
+        bulk.BulkLoader(self.engine, verbose=False, rebuild_indexes=False).load_segments(
+            [('d', LineString([(9.42, 45.79), (9.43, 45.79)]).wkb, [])])
+        degrees = dict(self.engine.execute('SELECT id, degree FROM segment_node_py').fetchall())
+        # Old nodes keep their ids, the end of c gets a second segment and d a new node
+        self.assertEqual(len(degrees), len(nodes) + 1)
+        end_of_c = self.engine.execute("SELECT end_node FROM segment_py WHERE name = 'c'").scalar()
+        self.assertEqual(degrees[end_of_c], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from mapgenerator import generator
+
+
+# Runs a python script instead of the map construction: it writes the outputs, then runs the given statement
+class ScriptGenerator(generator.MapGenerator):
+
+    def __init__(self, statement):
+        generator.MapGenerator.__init__(self)
+        self.statement = statement
+
+    def _java_args(self, input_path, output_path, eps=150.0, has_altitude=False, alt_eps=4.0):
+        script = 'import os, sys, time\n' \
+                 'for name in {!r}:\n' \
+                 '    open(os.path.join({!r}, name), "w").close()\n' \
+                 '{}\n'.format(generator.MAP_OUTPUTS, output_path, self.statement)
+        return [sys.executable, '-c', script]
+
+
+class TestMapGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.directory, 'input')
+        os.makedirs(self.input_path)
+        open(os.path.join(self.input_path, 'trip_1.txt'), 'w').close()
+        self.output_path = os.path.join(self.directory, 'output')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _outputs(self):
+        return [name for name in generator.MAP_OUTPUTS if os.path.isfile(os.path.join(self.output_path, name))]
+
+    def _run(self, statement, timeout=None):
+        job = generator.MapJob(self.input_path, self.output_path, timeout=timeout)
+        return ScriptGenerator(statement).run_map_jobs([job], workers=1, verbose=False)[0]
+
+    def test_done_job_is_skipped_next_time(self):
+        self.assertEqual(self._run('sys.exit(0)').status, generator.MapJob.DONE)
+        self.assertEqual(self._outputs(), list(generator.MAP_OUTPUTS))
+        self.assertEqual(self._run('sys.exit(0)').status, generator.MapJob.SKIPPED)
+
+    def test_failed_job_leaves_no_outputs(self):
+        job = self._run('sys.exit(3)')
+        self.assertEqual((job.status, job.returncode), (generator.MapJob.FAILED, 3))
+        self.assertEqual(self._outputs(), [])
+        self.assertEqual(self._run('sys.exit(0)').status, generator.MapJob.DONE)
+
+    def test_timed_out_job_leaves_no_outputs(self):
+        job = self._run('time.sleep(30)', timeout=0.5)
+        self.assertEqual(job.status, generator.MapJob.TIMEOUT)
+        self.assertLess(job.wall_time, 10)
+        self.assertEqual(self._outputs(), [])
+        self.assertEqual(self._run('sys.exit(0)').status, generator.MapJob.DONE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import utm
+from sqlalchemy import func
+from sqlalchemy import select
+
+from mapgenerator import graph
+from model import model
+from preprocessing import main
+from tests import fixtures
+
+
+# Nodes (latitude, longitude) and edges as read by the line by line parsing of the first map_to_graph
+def parse_map_files(directory):
+    nodes = {}
+    with open(os.path.join(directory, 'vertices.txt'), 'r') as vertices_file:
+        for vertex_raw in vertices_file:
+            id_pt, easting, northing, _ = vertex_raw.strip('\n').split(',')
+            nodes[int(id_pt)] = utm.to_latlon(float(easting), float(northing), 32, 'N')
+    edges = []
+    with open(os.path.join(directory, 'edges.txt'), 'r') as edges_file:
+        for edge_raw in edges_file:
+            _, start_pt_id, end_pt_id = edge_raw.strip('\n').split(',')
+            edges.append((int(start_pt_id), int(end_pt_id)))
+    return nodes, edges
+
+
+# Split the edges at the nodes closer than tolerance to them (other than their ends), one split at a time as the
+# first map_to_graph, until no node is on an edge. Returns the edges as sorted pairs
+def split_edges(nodes, edges, tolerance=graph.SNAP_TOLERANCE):
+    loops = set(edge for edge in edges if edge[0] == edge[1])
+    edges = set(tuple(sorted(edge)) for edge in edges if edge[0] != edge[1])
+    for node, (latitude, longitude) in sorted(nodes.items()):
+        while True:
+            candidates = sorted(edge for edge in edges if node not in edge)
+            if not candidates:
+                break
+            a = np.array([(nodes[u][1], nodes[u][0]) for u, _ in candidates])
+            b = np.array([(nodes[v][1], nodes[v][0]) for _, v in candidates])
+            d = b - a
+            p = np.array([longitude, latitude]) - a
+            squared_length = np.sum(d * d, axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = np.where(squared_length > 0, np.clip(np.sum(p * d, axis=1) / squared_length, 0, 1), 0)
+            on_edge = np.flatnonzero(np.hypot(*(p - d * t[:, np.newaxis]).T) < tolerance)
+            if not len(on_edge):
+                break
+            u, v = candidates[on_edge[0]]
+            edges.remove((u, v))
+            edges.update([tuple(sorted((u, node))), tuple(sorted((node, v)))])
+    return sorted(edges | loops)
+
+
+def chain_coordinates(paths):
+    return sorted(tuple((point.x, point.y) for point in path) for path in paths)
+
+
+class TestMapGraph(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.map_graph = graph.MapGraph()
+        cls.map_graph.map_to_graph(fixtures.MAP_DIRECTORY)
+        cls.nodes, cls.edges = parse_map_files(fixtures.MAP_DIRECTORY)
+
+    def test_nodes_match_line_parsing(self):
+        nodes = dict((node, (data['latitude'], data['longitude']))
+                     for node, data in self.map_graph.map_graph.nodes_iter(data=True))
+        self.assertEqual(sorted(nodes), sorted(self.nodes))
+        # The batched projection (pyproj) and the series of utm agree well within a millimeter
+        for node, (latitude, longitude) in self.nodes.items():
+            self.assertAlmostEqual(nodes[node][0], latitude, delta=1e-8)
+            self.assertAlmostEqual(nodes[node][1], longitude, delta=1e-8)
+
+    def test_edge_splits_match_one_by_one_splits(self):
+        edges = sorted(tuple(sorted(edge)) for edge in self.map_graph.map_graph.edges())
+        self.assertEqual(edges, split_edges(self.nodes, self.edges))
+
+    def test_chains_cover_each_edge_once(self):
+        adjacency = self.map_graph.map_graph.adj
+        position = dict(((data['longitude'], data['latitude']), node)
+                        for node, data in self.map_graph.map_graph.nodes_iter(data=True))
+        covered = []
+        for path in self.map_graph._get_segments_from_map():
+            chain = [position[(point.x, point.y)] for point in path]
+            covered += [tuple(sorted(edge)) for edge in zip(chain[:-1], chain[1:])]
+            inner = chain[1:-1]
+            self.assertTrue(all(len(adjacency[node]) == 2 for node in inner))
+            self.assertTrue(chain[0] == chain[-1] or
+                            (len(adjacency[chain[0]]) != 2 and len(adjacency[chain[-1]]) != 2))
+        self.assertEqual(sorted(covered), sorted(tuple(sorted(edge)) for edge in self.map_graph.map_graph.edges()))
+
+    def test_csr_chains_match_graph_chains(self):
+        csr_graph = graph.MapGraph()
+        csr_graph.map_to_csr(fixtures.MAP_DIRECTORY)
+        self.assertEqual(chain_coordinates(csr_graph._get_segments_from_map()),
+                         chain_coordinates(self.map_graph._get_segments_from_map()))
+
+    def test_snapshot_chains_match_graph_chains(self):
+        csr_graph = graph.MapGraph()
+        csr_graph.map_to_csr(fixtures.MAP_DIRECTORY)
+        directory = tempfile.mkdtemp()
+        try:
+            csr_graph.save_snapshot(os.path.join(directory, 'map'))
+            snapshot = graph.MapGraph()
+            snapshot.load_snapshot(os.path.join(directory, 'map'))
+            self.assertEqual(chain_coordinates(snapshot._get_segments_from_map()),
+                             chain_coordinates(self.map_graph._get_segments_from_map()))
+        finally:
+            shutil.rmtree(directory)
+
+
+@unittest.skipUnless(fixtures.TEST_DATABASE, 'needs a PostGIS database (HIKING_TEST_DATABASE)')
+class TestPathsToGeom(unittest.TestCase):
+
+    def _count_segments(self, engine, condition):
+        return engine.execute(select([func.count()]).select_from(model.Segment.__table__).where(condition)).scalar()
+
+    # The gpx segments come back with an incremental ingestion after the map replaced segment_py
+    def test_incremental_ingestion_after_map_load(self):
+        engine = fixtures.database_engine()
+        map_graph = graph.MapGraph()
+        map_graph.map_to_csr(fixtures.MAP_DIRECTORY)
+        n_chains = len(map_graph._get_segments_from_map())
+        gpx_pattern = fixtures.GPX_DIRECTORY + '*.gpx'
+
+        map_graph.paths_to_geom(db_engine=engine)
+        main.execute_with_gis(gpx_pattern, incremental=True, db_engine=engine)
+        n_gpx = self._count_segments(engine, model.Segment.source.isnot(None))
+        self.assertGreater(n_gpx, 0)
+
+        map_graph.paths_to_geom(db_engine=engine)
+        main.execute_with_gis(gpx_pattern, incremental=True, db_engine=engine)
+        self.assertEqual(self._count_segments(engine, model.Segment.source.isnot(None)), n_gpx)
+        self.assertEqual(self._count_segments(engine, model.Segment.source.is_(None)), n_chains)
+
+
+if __name__ == '__main__':
+    unittest.main()
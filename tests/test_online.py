@@ -0,0 +1,98 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+import unittest
+
+from gpxpy.gpx import GPXTrackPoint
+
+from preprocessing import online
+from preprocessing import splitter
+from preprocessing import util
+from tests import fixtures
+
+MAX_DIST_ERROR = fixtures.MAX_DIST_ERROR
+MAX_SPEED_ERROR = fixtures.MAX_SPEED_ERROR
+
+
+# Points a millimeter apart along a meridian, at constant speed: spt finds no error, the whole track is a single
+# sub-track
+def straight_track(n):
+    start = datetime.datetime(2018, 5, 27, 10, 0, 0)
+    return [GPXTrackPoint(45.8 + i * 1e-8, 9.45, time=start + datetime.timedelta(seconds=i)) for i in range(n)]
+
+
+def run_filter(spt_filter, points):
+    emitted = []
+    buffer_size = 0
+    for point in points:
+        emitted += spt_filter.push(point)
+        buffer_size = max(buffer_size, len(spt_filter.points))
+    return emitted + spt_filter.flush(), buffer_size
+
+
+class TestOnlineSPTFilter(unittest.TestCase):
+
+    def test_default_buffer_is_bounded(self):
+        self.assertEqual(online.OnlineSPTFilter(MAX_DIST_ERROR, MAX_SPEED_ERROR).max_buffer, online.MAX_BUFFER)
+        self.assertEqual(online.OnlineFilter(MAX_DIST_ERROR, MAX_SPEED_ERROR, 70, 100).spt.max_buffer,
+                         online.MAX_BUFFER)
+
+    def test_unbounded_buffer_matches_batch(self):
+        points = straight_track(60)
+        emitted, buffer_size = run_filter(online.OnlineSPTFilter(MAX_DIST_ERROR, MAX_SPEED_ERROR, max_buffer=None),
+                                          points)
+        self.assertEqual(emitted, util.spt(points, MAX_DIST_ERROR, MAX_SPEED_ERROR))
+        self.assertEqual(emitted, [points[1], points[-1]])
+        self.assertEqual(buffer_size, len(points))
+
+    def test_full_buffer_closes_sub_track(self):
+        points = straight_track(60)
+        max_buffer = 10
+        emitted, buffer_size = run_filter(online.OnlineSPTFilter(MAX_DIST_ERROR, MAX_SPEED_ERROR,
+                                                                 max_buffer=max_buffer), points)
+        self.assertLessEqual(buffer_size, max_buffer)
+        # Each sub-track restarts from the third-last point of the previous one: its second point is kept
+        cuts = range(0, len(points) - max_buffer + 1, max_buffer - 3)
+        last_start = cuts[-1] + max_buffer - 3
+        self.assertEqual(emitted, [points[start + 1] for start in cuts] + [points[last_start + 1], points[-1]])
+        # The batch output is the first and the last of these points
+        batch = util.spt(points, MAX_DIST_ERROR, MAX_SPEED_ERROR)
+        self.assertEqual([emitted[0], emitted[-1]], batch)
+
+
+class TestOnlineFilter(unittest.TestCase):
+
+    # Points pushed one by one give the segments of the batch preprocessing (duplicates removal, spt and bearing
+    # split), on the tracks of the fixture (sub-tracks without errors are shorter than MAX_BUFFER)
+    def test_online_filter_matches_batch(self):
+        tracks = [segment.points for segment in fixtures.gpxpy_segments()
+                  if len(segment.points) <= fixtures.SPT_MAX_POINTS]
+        expected = []
+        online_segments = []
+        for points in tracks:
+            filtered = util.spt(util.remove_duplicates(points), MAX_DIST_ERROR, MAX_SPEED_ERROR)
+            expected.append([fixtures.point_values(segment.points) for segment in splitter.bearing_splitter(
+                filtered, fixtures.DEGREE_THRESHOLD, fixtures.MIN_LENGTH)])
+            online_filter = online.OnlineFilter(MAX_DIST_ERROR, MAX_SPEED_ERROR, fixtures.DEGREE_THRESHOLD,
+                                                fixtures.MIN_LENGTH)
+            segments = online_filter.push_many(points) + online_filter.flush()
+            online_segments.append([fixtures.point_values(segment.points) for segment in segments])
+        self.assertEqual(online_segments, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import shutil
+import tempfile
+import unittest
+
+from preprocessing import cache
+from preprocessing import filter
+from preprocessing import main
+from tests import fixtures
+
+STAGES = ['original', 'deduplicated', 'filtered', 'splitted']
+
+
+def coordinates(segment):
+    if hasattr(segment, 'points'):
+        return [(point.latitude, point.longitude) for point in segment.points]
+    return zip(segment.latitude.tolist(), segment.longitude.tolist())
+
+
+def stage_coordinates(results):
+    return dict((stage, [[coordinates(seg) for seg in group] for group in results[stage]] if stage == 'splitted'
+                 else [coordinates(seg) for seg in results[stage]]) for stage in STAGES)
+
+
+class TestPreprocessingPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.file_hash = cache.file_hash
+        self.filter_segment_spt = filter.filter_segment_spt
+
+    def tearDown(self):
+        cache.file_hash = self.file_hash
+        filter.filter_segment_spt = self.filter_segment_spt
+        shutil.rmtree(self.cache_dir)
+
+    def _run(self):
+        return main.preprocessing_pipeline(fixtures.GPX_DIRECTORY, self.cache_dir).run(STAGES, verbose=False)
+
+    def test_cached_pipeline_matches_uncached(self):
+        uncached = main.preprocessing_pipeline(fixtures.GPX_DIRECTORY).run(STAGES, verbose=False)
+        self.assertEqual(stage_coordinates(self._run()), stage_coordinates(uncached))
+
+    def test_files_are_hashed_once(self):
+        hashed = []
+        cache.file_hash = lambda filename: hashed.append(filename) or self.file_hash(filename)
+        self._run()
+        self.assertEqual(sorted(hashed), fixtures.gpx_files())
+
+    def test_second_run_reads_the_cache(self):
+        first = stage_coordinates(self._run())
+
+        def fail(*args):
+            raise AssertionError('filtered segments should come from the cache')
+        filter.filter_segment_spt = fail
+        self.assertEqual(stage_coordinates(self._run()), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import gpxpy
+
+from receiver import reader
+from tests import fixtures
+
+# Tracks without points: no segments, an empty segment, and a named track with an empty segment
+EMPTY_TRACKS = '<trk></trk><trk><trkseg></trkseg></trk><trk><name>empty</name><trkseg></trkseg></trk>'
+
+
+class TestTrackLengths(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Copy of the first fixture file, with the empty tracks before and after its tracks
+    def _file_with_empty_tracks(self):
+        content = open(fixtures.gpx_files()[0]).read()
+        first = content.index('<trk>')
+        last = content.rindex('</trk>') + len('</trk>')
+        filename = os.path.join(self.directory, 'empty-tracks.gpx')
+        with open(filename, 'w') as gpx_file:
+            gpx_file.write(content[:first] + EMPTY_TRACKS + content[first:last] + EMPTY_TRACKS + content[last:])
+        return filename
+
+    # One length per track, as the baseline gpx_length_stats computed with gpxpy
+    def assertSameLengths(self, filename):
+        expected = [gpx_track.length_2d() / 1000.0 for gpx_track in gpxpy.parse(open(filename, 'r')).tracks]
+        length_km = reader._file_tracks_length_km(filename)
+        self.assertEqual(len(length_km), len(expected))
+        for length, expected_length in zip(length_km, expected):
+            self.assertAlmostEqual(length, expected_length, places=9)
+
+    def test_lengths_match_gpxpy(self):
+        for filename in fixtures.gpx_files():
+            self.assertSameLengths(filename)
+
+    def test_empty_tracks_are_counted(self):
+        filename = self._file_with_empty_tracks()
+        self.assertSameLengths(filename)
+        length_km = reader._file_tracks_length_km(filename)
+        self.assertEqual(length_km[:3], [0., 0., 0.])
+        self.assertEqual(length_km[-3:], [0., 0., 0.])
+        # Segments (also the empty ones) are still streamed
+        self.assertEqual(len(list(reader.gpx_file_stream(filename))),
+                         len(list(reader.gpx_file_stream(fixtures.gpx_files()[0]))) + 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
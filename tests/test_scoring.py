@@ -0,0 +1,95 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import new
+import unittest
+import warnings
+
+import numpy as np
+
+from recommendation import engine
+from recommendation import scoring
+from tests import fixtures
+
+try:
+    from recommendation import recommender
+except ImportError:  # Recommender connects to PostgreSQL (psycopg2)
+    recommender = None
+
+# Profiles of the users: zero and partly zero profiles give undefined (nan) similarities
+PROFILES = [[0.2, 0.0, 0.7, 0.1], [1.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.5, 0.5],
+            [0.3, 0.9, 0.1, 0.4]]
+EXACT_LEN = 4000
+
+
+class Profile:
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def get_profile(self):
+        return self.profile
+
+
+def same_scores(first, second):
+    first, second = np.asarray(first), np.asarray(second)
+    return bool(np.all((first == second) | (np.isnan(first) & np.isnan(second))))
+
+
+class TestPathScorer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.segment_graph = engine.SegmentGraph().index(fixtures.map_segments())
+        cls.paths = [path for latitude, longitude in fixtures.START_POSITIONS
+                     for path in cls.segment_graph.candidate_paths(longitude, latitude, 400, 0, EXACT_LEN)]
+
+    def _scorer(self):
+        return scoring.PathScorer(self.paths, self.segment_graph.property_matrix)
+
+    # Recommender.path_similarity (segment by segment, user-024 baseline) gives the same scores
+    @unittest.skipIf(recommender is None, 'recommendation.recommender needs the PostgreSQL driver')
+    def test_scores_match_path_similarity(self):
+        scorer = self._scorer()
+        loop_recommender = new.instance(recommender.Recommender)
+        loop_recommender.exact_len = EXACT_LEN
+        loop_recommender.property_matrix = self.segment_graph.property_matrix
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # scipy cosine of zero vectors
+            for profile in PROFILES:
+                loop_recommender.user = Profile(profile)
+                for method in [scoring.GLOCAL, scoring.LOCAL, scoring.GLOBAL]:
+                    for baseline in [False, True]:
+                        expected = [loop_recommender.path_similarity(path, method, baseline) for path in self.paths]
+                        self.assertTrue(same_scores(scorer.scores(method, profile, EXACT_LEN, baseline), expected),
+                                        (profile, method, baseline))
+
+    def test_user_scores_match_single_user_scores(self):
+        scorer = self._scorer()
+        block_size = scoring.BLOCK_SIZE
+        scoring.BLOCK_SIZE = scorer.vectors.size * 2  # two users per block
+        try:
+            for method in [scoring.GLOCAL, scoring.LOCAL, scoring.GLOBAL]:
+                for baseline in [False, True]:
+                    scores = scorer.user_scores(method, PROFILES, EXACT_LEN, baseline)
+                    for profile, user_scores in zip(PROFILES, scores):
+                        self.assertTrue(same_scores(user_scores, scorer.scores(method, profile, EXACT_LEN, baseline)))
+        finally:
+            scoring.BLOCK_SIZE = block_size
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+
+from preprocessing import filter
+from preprocessing import splitter
+from tests import fixtures
+
+
+def coordinates(points):
+    return [(point.latitude, point.longitude) for point in points]
+
+
+class TestBearingSplitter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.segments = [filter.filter_segment_spt(segment, fixtures.MAX_DIST_ERROR, fixtures.MAX_SPEED_ERROR, True)
+                        for segment in fixtures.array_segments()]
+        cls.tracks = [segment.points for segment in cls.segments]
+
+    def _check(self, min_length):
+        expected = [[coordinates(piece.points)
+                     for piece in splitter.bearing_splitter(points, fixtures.DEGREE_THRESHOLD, min_length)]
+                    for points in self.tracks]
+        vectorized = [[coordinates(piece.points) for piece in splitter.bearing_splitter_vectorized(
+            points, fixtures.DEGREE_THRESHOLD, min_length)] for points in self.tracks]
+        arrays = [[coordinates(piece.points) for piece in splitter.bearing_splitter_arrays(
+            segment, fixtures.DEGREE_THRESHOLD, min_length)] for segment in self.segments]
+        self.assertEqual(vectorized, expected)
+        self.assertEqual(arrays, expected)
+
+    def test_vectorized_matches_bearing_splitter(self):
+        self._check(fixtures.MIN_LENGTH)
+
+    def test_min_length_matches_bearing_splitter(self):
+        self._check(100)
+
+    def test_tracks_in_one_array(self):
+        segment = self.segments[0]
+        offsets = [0, 300, len(segment)]
+        ranges = splitter.bearing_split_ranges(segment.latitude, segment.longitude, fixtures.DEGREE_THRESHOLD,
+                                               fixtures.MIN_LENGTH, offsets)
+        expected = []
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            expected += [(first + start, last + start) for first, last in splitter.bearing_split_ranges(
+                segment.latitude[start:end], segment.longitude[start:end], fixtures.DEGREE_THRESHOLD,
+                fixtures.MIN_LENGTH).tolist()]
+        self.assertEqual([tuple(pair) for pair in ranges.tolist()], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import unittest
+
+from shapely.geometry import Point
+from shapely.ops import substring
+from sqlalchemy.orm import sessionmaker
+
+from mapgenerator import graph
+from recommendation import engine
+from recommendation import topology
+from tests import fixtures
+
+Row = collections.namedtuple('Row', ['rank', 'ids', 'length', 'from_start', 'start_wkb'])
+
+# (start_threshold, min_len, exact_len) of the searches
+SEARCHES = [(50, 1950, 2000), (400, 3500, 4000), (400, 500, 1000)]
+
+# Largest difference (meters) between the lengths computed by PostGIS (ST_Length on the spheroid) and in Python
+MAX_LENGTH_ERROR = 1e-2
+
+
+# Rows of topology.CANDIDATE_PATHS computed in Python on a SegmentGraph, as the query does on segment_py and
+# segment_node_py (the query itself needs PostGIS): nodes are the snapped ends of the segments
+def candidate_path_rows(segment_graph, longitude, latitude, threshold, exact_len):
+    keys = sorted(set(segment_graph._key(coordinate) for segment in segment_graph.segments
+                      for coordinate in [segment.shape.coords[0], segment.shape.coords[-1]]))
+    node_ids = dict((key, i + 1) for i, key in enumerate(keys))
+    segments = dict((segment.id, segment) for segment in segment_graph.segments)
+    ends = dict((segment.id, (node_ids[segment_graph._key(segment.shape.coords[0])],
+                              node_ids[segment_graph._key(segment.shape.coords[-1])]))
+                for segment in segment_graph.segments)
+    at_node = collections.defaultdict(set)
+    for segment_id, (start_node, end_node) in ends.items():
+        at_node[start_node].add(segment_id)
+        at_node[end_node].add(segment_id)
+    at_node = dict((node, sorted(ids)) for node, ids in at_node.items())
+
+    # Start halves (distance, segment id, half, far node, from_start, geometry)
+    halves = []
+    for i, distance in segment_graph.nearest_segments(longitude, latitude, threshold):
+        segment = segment_graph.segments[i]
+        located = segment.shape.project(Point(longitude, latitude), normalized=True)
+        if located > 0:
+            halves.append((distance, segment.id, 0, ends[segment.id][0], False,
+                           substring(segment.shape, 0, located, normalized=True)))
+        if located < 1:
+            halves.append((distance, segment.id, 1, ends[segment.id][1], True,
+                           substring(segment.shape, located, 1, normalized=True)))
+    halves.sort(key=lambda half: half[:3])
+
+    rows = []
+    for rank, (_, segment_id, _, far_node, from_start, shape) in enumerate(halves, 1):
+        leaves = []
+        pending = [([segment_id], [segments[segment_id].name], far_node, engine.line_length(shape.coords), from_start)]
+        while pending:
+            ids, names, node, length, last_from_start = pending.pop()
+            if length > exact_len or len(at_node[node]) == 1:
+                leaves.append(Row(rank, ids, length, last_from_start, shape.wkb))
+                continue
+            for next_id in at_node[node]:
+                name = segments[next_id].name
+                if name in names or any(segments[i].name == name for i in at_node[node] if i < next_id):
+                    continue
+                siblings = [segments[i].name for i in at_node[node] if i < next_id and segments[i].name not in names]
+                start_node, end_node = ends[next_id]
+                far = start_node if start_node != node else end_node
+                pending.append((ids + [next_id], names + siblings + [name], far, length + segments[next_id].length,
+                                start_node != far))
+        rows += sorted(leaves, key=lambda row: row.ids)
+    return rows
+
+
+# Names, lengths and last points of the paths
+def path_values(paths):
+    return [([segment.name for segment in segments], round(length, 6),
+             [round(segment.length, 4) for segment in segments],
+             [tuple(round(c, 9) for c in segment.shape.coords[-1]) for segment in segments])
+            for segments, length in paths]
+
+
+# SegmentGraph (in memory search, user-019) against topology.candidate_paths (search by the database, user-020)
+class TestCandidatePaths(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.segment_graph = engine.SegmentGraph().index(fixtures.map_segments())
+
+    def setUp(self):
+        self.candidate_path_rows = topology.candidate_path_rows
+        self.load_segments = topology._load_segments
+        segment_graph = self.segment_graph
+        topology.candidate_path_rows = lambda session, longitude, latitude, threshold, exact_len: \
+            candidate_path_rows(segment_graph, longitude, latitude, threshold, exact_len)
+        topology._load_segments = lambda session, ids: dict((segment.id, segment)
+                                                            for segment in segment_graph.segments if segment.id in ids)
+
+    def tearDown(self):
+        topology.candidate_path_rows = self.candidate_path_rows
+        topology._load_segments = self.load_segments
+
+    def test_database_search_matches_segment_graph(self):
+        for latitude, longitude in fixtures.START_POSITIONS:
+            for start_threshold, min_len, exact_len in SEARCHES:
+                expected = self.segment_graph.candidate_paths(longitude, latitude, start_threshold, min_len,
+                                                              exact_len)
+                paths = topology.candidate_paths(None, longitude, latitude, start_threshold, min_len, exact_len)
+                self.assertTrue(expected)
+                self.assertEqual(path_values(paths), path_values(expected))
+
+    def test_paths_are_connected(self):
+        segment_graph = self.segment_graph
+        for latitude, longitude in fixtures.START_POSITIONS:
+            for start_threshold, min_len, exact_len in SEARCHES:
+                for segments, length in segment_graph.candidate_paths(longitude, latitude, start_threshold, min_len,
+                                                                      exact_len):
+                    self.assertTrue(min_len < length <= exact_len)
+                    for first, second in zip(segments[:-1], segments[1:]):
+                        first_ends = set(segment_graph._key(c) for c in [first.shape.coords[0],
+                                                                         first.shape.coords[-1]])
+                        second_ends = set(segment_graph._key(c) for c in [second.shape.coords[0],
+                                                                          second.shape.coords[-1]])
+                        self.assertTrue(first_ends & second_ends)
+
+
+# The real CANDIDATE_PATHS query, on the fixture map loaded in PostGIS, against SegmentGraph on the same segments
+@unittest.skipUnless(fixtures.TEST_DATABASE, 'needs a PostGIS database (HIKING_TEST_DATABASE)')
+class TestCandidatePathsQuery(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_engine = fixtures.database_engine()
+        map_graph = graph.MapGraph()
+        map_graph.map_to_csr(fixtures.MAP_DIRECTORY)
+        map_graph.paths_to_geom(db_engine=cls.db_engine)
+        cls.segment_graph = engine.SegmentGraph(cls.db_engine).load()
+
+    def setUp(self):
+        self.session = sessionmaker(bind=self.db_engine)()
+
+    def tearDown(self):
+        self.session.close()
+
+    def assertSamePaths(self, paths, expected):
+        self.assertEqual([[segment.name for segment in segments] for segments, _ in paths],
+                         [[segment.name for segment in segments] for segments, _ in expected])
+        for (segments, length), (expected_segments, expected_length) in zip(paths, expected):
+            self.assertAlmostEqual(length, expected_length, delta=MAX_LENGTH_ERROR)
+            for segment, expected_segment in zip(segments, expected_segments):
+                self.assertAlmostEqual(segment.length, expected_segment.length, delta=MAX_LENGTH_ERROR)
+
+    def test_query_matches_segment_graph(self):
+        for latitude, longitude in fixtures.START_POSITIONS:
+            for start_threshold, min_len, exact_len in SEARCHES:
+                expected = self.segment_graph.candidate_paths(longitude, latitude, start_threshold, min_len,
+                                                              exact_len)
+                paths = topology.candidate_paths(self.session, longitude, latitude, start_threshold, min_len,
+                                                 exact_len)
+                self.assertTrue(expected)
+                self.assertSamePaths(paths, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
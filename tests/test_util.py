@@ -0,0 +1,47 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+
+from preprocessing import filter
+from preprocessing import util
+from tests import fixtures
+
+
+# util.spt_indices (through spt_vectorized and filter_segment_spt) against the recursive util.spt
+class TestSPT(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tracks = [util.remove_duplicates(segment.points) for segment in fixtures.gpxpy_segments()
+                      if len(segment.points) <= fixtures.SPT_MAX_POINTS]
+        cls.expected = [fixtures.point_values(util.spt(points, fixtures.MAX_DIST_ERROR, fixtures.MAX_SPEED_ERROR))
+                        for points in cls.tracks]
+
+    def test_spt_vectorized_matches_spt(self):
+        filtered = [util.spt_vectorized(points, fixtures.MAX_DIST_ERROR, fixtures.MAX_SPEED_ERROR)
+                    for points in self.tracks]
+        self.assertEqual([fixtures.point_values(points) for points in filtered], self.expected)
+
+    def test_array_segments_match_spt(self):
+        segments = [segment for segment in fixtures.array_segments() if len(segment) <= fixtures.SPT_MAX_POINTS]
+        filtered = [filter.filter_segment_spt(segment, fixtures.MAX_DIST_ERROR, fixtures.MAX_SPEED_ERROR, True)
+                    for segment in segments]
+        self.assertEqual([fixtures.point_values(segment.points) for segment in filtered], self.expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
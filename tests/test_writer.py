@@ -0,0 +1,94 @@
+"""
+Copyright 2018 Vincenzo Cutrona
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+ http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import glob
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import utm
+
+from receiver import reader
+from tests import fixtures
+from writer import writer
+
+# Largest distance (meters) between the projected points and the ones of utm.from_latlon: the projection is done by
+# pyproj, which agrees with utm up to fractions of a millimeter
+MAX_UTM_ERROR = 1e-3
+
+
+class TestWriter(unittest.TestCase):
+
+    def setUp(self):
+        # Local time with DST, where naive and UTC times disagree
+        self.tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'Europe/Rome'
+        time.tzset()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if self.tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.tz
+        time.tzset()
+        shutil.rmtree(self.directory)
+
+    def _export(self, segments, name, file_format=writer.TEXT):
+        directory = os.path.join(self.directory, name)
+        writer.export_segments(segments, directory, file_format)
+        files = sorted(glob.glob(os.path.join(directory, 'trip_*')))
+        return [open(filename, 'rb').read() for filename in files]
+
+    # The ArraySegment (streamed, cached) and gpxpy segment paths write the same trip files
+    def test_array_and_gpxpy_segments_write_same_files(self):
+        gpxpy_segments = fixtures.gpxpy_segments()
+        array_segments = fixtures.array_segments()
+        for file_format in [writer.TEXT, writer.BINARY]:
+            gpxpy_files = self._export(gpxpy_segments, 'gpxpy_' + file_format, file_format)
+            array_files = self._export(array_segments, 'array_' + file_format, file_format)
+            self.assertEqual(len(gpxpy_files), len(array_files))
+            for gpxpy_file, array_file in zip(gpxpy_files, array_files):
+                self.assertEqual(gpxpy_file, array_file)
+
+    # Timestamps are the ones of time.mktime(point.time.timetuple())
+    def test_timestamps_match_mktime(self):
+        for segment in fixtures.gpxpy_segments():
+            expected = [time.mktime(point.time.timetuple()) for point in segment.points]
+            array_segment = reader.ArraySegment.from_points(segment.points)
+            for arrays_segment in [segment, array_segment]:
+                _, _, timestamps = writer.segment_to_utm_arrays(arrays_segment)
+                self.assertEqual(timestamps.tolist(), expected)
+
+    # The exported text files have the points of utm.from_latlon (up to MAX_UTM_ERROR) and the same timestamps
+    def test_text_export_matches_utm(self):
+        segments = fixtures.gpxpy_segments()
+        directory = os.path.join(self.directory, 'utm')
+        writer.export_segments(segments, directory)
+        for i, segment in enumerate(segments):
+            lines = [line.split() for line in open(os.path.join(directory, 'trip_{}.txt'.format(i)))]
+            self.assertEqual(len(lines), len(segment.points))
+            for point, (easting, northing, timestamp) in zip(segment.points, lines):
+                expected_easting, expected_northing, _, _ = utm.from_latlon(point.latitude, point.longitude)
+                self.assertAlmostEqual(float(easting), expected_easting, delta=MAX_UTM_ERROR)
+                self.assertAlmostEqual(float(northing), expected_northing, delta=MAX_UTM_ERROR)
+                self.assertEqual(float(timestamp), time.mktime(point.time.timetuple()))
+
+
+if __name__ == '__main__':
+    unittest.main()
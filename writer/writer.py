@@ -16,21 +16,149 @@ limitations under the License.
 
 import glob
 import os
+import struct
 import time
 
-import utm
+import numpy as np
+
+from preprocessing import parallel
+from preprocessing import projection
+
+TEXT = 'txt'
+BINARY = 'bin'
+
+# Packed trajectory: magic, number of points, then (easting, northing, timestamp) little endian float64 triples
+BINARY_MAGIC = 'TRJ1'
+BINARY_HEADER = struct.Struct('<4sI')
+WRITE_BUFFER = 1 << 20
+
+
+# Interpret wall clock seconds as local time, as time.mktime(point.time.timetuple()) does (isdst is the tm_isdst
+# flag of the time tuples: -1 for naive times). The local offset is computed once, unless it changes (DST)
+# between the first and the last point
+def _local_timestamps(wall_seconds, isdst=-1):
+    def mktime(seconds):
+        return time.mktime(time.gmtime(seconds)[:8] + (isdst,))
+
+    if len(wall_seconds) == 0:
+        return wall_seconds
+    first, last = wall_seconds[0], wall_seconds[-1]
+    if first != first or last != last:
+        return wall_seconds  # missing times
+    first_offset = mktime(first) - first
+    if mktime(last) - last == first_offset:
+        return wall_seconds + first_offset
+    return np.array([mktime(s) if s == s else s for s in wall_seconds.tolist()])
+
+
+# (eastings, northings, timestamps) of a segment, as arrays. Works with ArraySegment and GPXTrackSegment
+def segment_to_utm_arrays(segment):
+    if hasattr(segment, 'latitude'):
+        latitudes, longitudes = segment.latitude, segment.longitude
+        wall_seconds = np.floor(segment.time)  # timetuple() drops the fractional seconds
+        isdst = 0  # times of array segments are UTC, as the (aware) times of gpxpy points
+    else:
+        points = segment.points
+        latitudes = np.array([point.latitude for point in points], dtype=np.float64)
+        longitudes = np.array([point.longitude for point in points], dtype=np.float64)
+        stamps = np.array([point.time.replace(tzinfo=None) for point in points], dtype='datetime64[us]')
+        wall_seconds = stamps.astype('datetime64[s]').astype(np.int64).astype(np.float64)
+        isdst = points[0].time.timetuple().tm_isdst if points else -1
+    eastings, northings, _, _ = projection.to_utm(latitudes, longitudes)
+    return eastings, northings, _local_timestamps(wall_seconds, isdst)
+
+
+# Same text of the original per point writer ("easting northing timestamp" lines)
+def _encode_text(eastings, northings, timestamps):
+    lines = map('{} {} {}\n'.format, eastings.tolist(), northings.tolist(), timestamps.tolist())
+    return ''.join(lines)
+
+
+def _encode_binary(eastings, northings, timestamps):
+    data = np.empty((len(eastings), 3), dtype='<f8')
+    data[:, 0], data[:, 1], data[:, 2] = eastings, northings, timestamps
+    return BINARY_HEADER.pack(BINARY_MAGIC, len(data)) + data.tobytes()
+
+
+# Read a text trajectory, as an (n, 3) array of easting, northing, timestamp
+def read_text_trajectory(filename):
+    return np.loadtxt(filename, dtype=np.float64, ndmin=2).reshape(-1, 3)
+
+
+# Read a packed trajectory back, as an (n, 3) array of easting, northing, timestamp
+def read_binary_trajectory(filename):
+    with open(filename, 'rb') as trajectory:
+        magic, count = BINARY_HEADER.unpack(trajectory.read(BINARY_HEADER.size))
+        if magic != BINARY_MAGIC:
+            raise ValueError('{} is not a packed trajectory'.format(filename))
+        return np.fromfile(trajectory, dtype='<f8', count=count * 3).reshape(count, 3)
+
+
+# Write content to filename, unless it already has the same content. Returns True if the file was written
+def _write_if_changed(filename, content):
+    if os.path.exists(filename) and os.path.getsize(filename) == len(content):
+        with open(filename, 'rb') as old:
+            if old.read() == content:
+                return False
+    with open(filename, 'wb', WRITE_BUFFER) as new_file:
+        new_file.write(content)
+    return True
+
+
+# Project and encode a segment, and write it. Module level, so that it can run in worker processes
+def _export_segment(job):
+    segment, filename, file_format = job
+    arrays = segment_to_utm_arrays(segment)
+    content = _encode_binary(*arrays) if file_format == BINARY else _encode_text(*arrays)
+    return _write_if_changed(filename, content)
+
+
+# Print each segment in its own file (trip_<i>.txt or trip_<i>.bin), projecting segments as arrays.
+# Files with unchanged content are not rewritten, trip files of previous runs that are not produced anymore are
+# removed. processes: workers used to encode and write segments (1 means in this process).
+# Returns the number of written files
+def export_segments(segments, directory, file_format=TEXT, processes=1):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    filenames = []
+
+    def jobs():
+        for i, segment in enumerate(segments):
+            filename = os.path.join(directory, 'trip_{}.{}'.format(i, file_format))
+            filenames.append(filename)
+            yield segment, filename, file_format
+
+    written = sum(parallel.imap_ordered(_export_segment, jobs(), processes, chunksize=16))
+    _remove_stale_trips(directory, file_format, filenames)
+    return written
+
+
+# Same of export_segments, for trajectories already projected: (eastings, northings, timestamps) arrays
+def export_utm_trajectories(trajectories, directory, file_format=TEXT):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    filenames = []
+    written = 0
+    for i, arrays in enumerate(trajectories):
+        filenames.append(os.path.join(directory, 'trip_{}.{}'.format(i, file_format)))
+        content = _encode_binary(*arrays) if file_format == BINARY else _encode_text(*arrays)
+        written += _write_if_changed(filenames[-1], content)
+    _remove_stale_trips(directory, file_format, filenames)
+    return written
+
+
+def _remove_stale_trips(directory, file_format, produced):
+    produced = set(produced)
+    for stale in glob.glob(os.path.join(directory, 'trip_*.' + file_format)):
+        if stale not in produced:
+            os.remove(stale)
 
 
 # Print each segment in its own file. Use "easting northing timestamp" format.
-def gpx_segments_to_utm_txt(segments, directory):
-    files = glob.glob(directory + '*')
-    for f in files:
-        os.remove(f)
-    i = 0
-    for segment in segments:
-        new_file = open(directory + "trip_{}.txt".format(i), 'w')
-        for point in segment.points:
-            easting, northing, zone_number, zone_letter = utm.from_latlon(point.latitude, point.longitude)
-            new_file.write('{} {} {}\n'.format(easting, northing, time.mktime(point.time.timetuple())))
-        new_file.close()
-        i += 1
+def gpx_segments_to_utm_txt(segments, directory, processes=1):
+    return export_segments(segments, directory, TEXT, processes)
+
+
+# Print each segment in its own packed binary file (see read_binary_trajectory)
+def gpx_segments_to_utm_bin(segments, directory, processes=1):
+    return export_segments(segments, directory, BINARY, processes)